@@ -0,0 +1,121 @@
+"""Backends used to process deferred history link updates."""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, connections, router, transaction
+from django.utils.encoding import force_str
+from django.utils.module_loading import import_string
+
+from historylinks.conf import get_setting
+from historylinks.models import HistoryLinkQueueItem
+
+
+logger = logging.getLogger("historylinks")
+
+
+class DeferredBackend(object):
+
+    """
+    Base class for backends that process deferred history link updates.
+
+    Updates are enqueued after the transaction that saved the objects has been committed,
+    as a dict of models to sets of primary keys.
+    """
+
+    def enqueue(self, manager, pending):
+        """Enqueues the history link updates for the given manager and pending objects."""
+        raise NotImplementedError
+
+
+class ThreadPoolBackend(DeferredBackend):
+
+    """Processes deferred history link updates in a pool of background threads."""
+
+    def __init__(self):
+        """Initializes the thread pool backend."""
+        self._executor = None
+        self._lock = Lock()
+
+    def _get_executor(self):
+        """Returns the thread pool, creating it if required."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=get_setting("THREAD_POOL_WORKERS"),
+                    thread_name_prefix="historylinks",
+                )
+            return self._executor
+
+    def _process(self, manager, pending):
+        """Updates the history links in a background thread."""
+        try:
+            for model, pks in pending.items():
+                manager._update_pks_history_links(model, pks)
+        except Exception:
+            logger.exception("Could not update deferred history links")
+        finally:
+            close_old_connections()
+
+    def enqueue(self, manager, pending):
+        """Submits the history link updates to the thread pool."""
+        self._get_executor().submit(self._process, manager, pending)
+
+
+class DatabaseBackend(DeferredBackend):
+
+    """
+    Stores deferred history link updates in a database queue.
+
+    The queue is processed by the processhistorylinks management command, using the
+    default history link manager. Repeated updates to the same object are coalesced.
+    """
+
+    def enqueue(self, manager, pending):
+        """Adds the history link updates to the queue."""
+        HistoryLinkQueueItem.objects.bulk_create([
+            HistoryLinkQueueItem(
+                content_type=ContentType.objects.get_for_model(model),
+                object_id=force_str(pk),
+            )
+            for model, pks in pending.items()
+            for pk in pks
+        ], ignore_conflicts=True)
+
+    def process(self, manager, batch_size):
+        """
+        Processes a batch of queued history link updates, returning the number of objects processed.
+
+        Queue items are removed in the same transaction that updates their history links, so
+        an object enqueued again during processing will be processed again.
+        """
+        connection = connections[router.db_for_write(HistoryLinkQueueItem)]
+        with transaction.atomic(using=connection.alias):
+            queue_items = list(HistoryLinkQueueItem.objects.select_for_update(
+                skip_locked=connection.features.has_select_for_update_skip_locked,
+            ).order_by("pk")[:batch_size])
+            HistoryLinkQueueItem.objects.filter(pk__in=[queue_item.pk for queue_item in queue_items]).delete()
+            pending = {}
+            for queue_item in queue_items:
+                model = ContentType.objects.get_for_id(queue_item.content_type_id).model_class()
+                if model is not None and manager.is_registered(model):
+                    pending.setdefault(model, set()).add(model._meta.pk.to_python(queue_item.object_id))
+            for model, pks in pending.items():
+                manager._update_pks_history_links(model, pks)
+        return len(queue_items)
+
+
+_backends = {}
+
+
+def get_backend():
+    """Returns the backend used to process deferred history link updates, or None if updates are not deferred."""
+    backend_path = get_setting("DEFERRED_BACKEND")
+    if backend_path is None:
+        return None
+    try:
+        return _backends[backend_path]
+    except KeyError:
+        backend = _backends[backend_path] = import_string(backend_path)()
+        return backend
@@ -0,0 +1,74 @@
+"""Caching of resolved history links."""
+import hashlib
+
+from django.core.cache import caches
+from django.db import transaction
+
+from historylinks.conf import get_setting
+
+
+# Cached in place of a missing current URL.
+_MISSING = ""
+
+
+def get_cache():
+    """Returns the cache used to store resolved history links, or None if caching is disabled."""
+    cache_alias = get_setting("CACHE")
+    if cache_alias is None:
+        return None
+    return caches[cache_alias]
+
+
+def get_cache_key(path):
+    """Returns the cache key used to store the current URL for the given path."""
+    return "{prefix}:{digest}".format(
+        prefix=get_setting("CACHE_KEY_PREFIX"),
+        digest=hashlib.sha256(path.encode("utf-8")).hexdigest(),
+    )
+
+
+def get_cached_current_url(cache, path, get_current_url):
+    """
+    Returns the current URL for the given path, using the cache if possible.
+
+    On a cache miss, get_current_url is called with the path, and its result is cached.
+    """
+    cache_key = get_cache_key(path)
+    current_url = cache.get(cache_key)
+    if current_url is None:
+        current_url = get_current_url(path)
+        if current_url:
+            cache.set(cache_key, current_url, get_setting("CACHE_TIMEOUT"))
+        else:
+            cache.set(cache_key, _MISSING, get_setting("CACHE_NEGATIVE_TIMEOUT"))
+    return current_url or None
+
+
+async def aget_cached_current_url(cache, path, aget_current_url):
+    """
+    Returns the current URL for the given path, using the async cache API if possible.
+
+    On a cache miss, aget_current_url is awaited with the path, and its result is cached.
+    """
+    cache_key = get_cache_key(path)
+    current_url = await cache.aget(cache_key)
+    if current_url is None:
+        current_url = await aget_current_url(path)
+        if current_url:
+            await cache.aset(cache_key, current_url, get_setting("CACHE_TIMEOUT"))
+        else:
+            await cache.aset(cache_key, _MISSING, get_setting("CACHE_NEGATIVE_TIMEOUT"))
+    return current_url or None
+
+
+def invalidate_current_urls(cache, paths):
+    """
+    Removes the current URLs for the given paths from the cache.
+
+    The current URLs are removed immediately, and again when the current transaction
+    commits, so that concurrent requests cannot cache an uncommitted change.
+    """
+    cache_keys = [get_cache_key(path) for path in paths]
+    if cache_keys:
+        cache.delete_many(cache_keys)
+        transaction.on_commit(lambda: cache.delete_many(cache_keys))
@@ -0,0 +1,69 @@
+"""Settings used by django-historylinks."""
+from django.conf import settings
+
+
+DEFAULTS = {
+    # Store the current URL of each object on its history links, allowing them to be
+    # resolved with a single query, without loading the object.
+    "STORE_CURRENT_URL": False,
+    # The alias of the cache used to store resolved history links, or None to disable caching.
+    "CACHE": None,
+    # The number of seconds to cache a resolved history link.
+    "CACHE_TIMEOUT": 300,
+    # The number of seconds to cache a path that is not a history link.
+    "CACHE_NEGATIVE_TIMEOUT": 60,
+    # The prefix used for cache keys.
+    "CACHE_KEY_PREFIX": "historylinks",
+    # The maximum number of history links followed when resolving a chain of history links.
+    # Each link followed costs an extra lookup, so chains are not followed by default. With
+    # HISTORYLINKS_CACHE, a resolved chain is only evicted when the object of its first history
+    # link changes, so a change to a later object in the chain is not seen until the cached URL
+    # expires after HISTORYLINKS_CACHE_TIMEOUT. Run collapsehistorylinks to shorten chains.
+    "MAX_REDIRECT_DEPTH": 1,
+    # Resolve history links from an in-memory map of permalinks to current URLs, loaded from
+    # the database. Requires HISTORYLINKS_STORE_CURRENT_URL.
+    "REDIRECT_MAP": False,
+    # The number of seconds between incremental refreshes of the redirect map.
+    "REDIRECT_MAP_REFRESH_INTERVAL": 60,
+    # The number of seconds between full reloads of the redirect map, which remove history
+    # links deleted in other processes. Tombstones are picked up by the next refresh.
+    "REDIRECT_MAP_RELOAD_INTERVAL": 3600,
+    # The dotted path of a backend used to process history link updates after the end of each
+    # history link context, or None to update history links immediately.
+    "DEFERRED_BACKEND": None,
+    # The number of threads used by historylinks.backends.ThreadPoolBackend.
+    "THREAD_POOL_WORKERS": 1,
+    # What to do with the history links of a registered object when it is deleted. Use "delete" to
+    # delete them, "tombstone" to keep them as tombstones that answer 410 Gone, or None to keep
+    # them until the prunehistorylinks command is run. Deleting objects of a registered model is
+    # slower when enabled, as each object is loaded, and its history links updated with an extra
+    # query.
+    "ON_DELETE": None,
+    # The number of seconds a 410 Gone response for a tombstone may be cached for, or None to
+    # prevent caching.
+    "GONE_CACHE_TIMEOUT": None,
+    # The status code of a rescued redirect. Use 308 to preserve the request method.
+    "REDIRECT_STATUS": 301,
+    # The number of seconds a rescued redirect may be cached for, sent as max-age. If this and
+    # HISTORYLINKS_REDIRECT_SHARED_CACHE_TIMEOUT are None, redirects are never cached.
+    "REDIRECT_CACHE_TIMEOUT": None,
+    # The number of seconds a rescued redirect may be cached for by shared caches, such as a
+    # CDN, sent as s-maxage, or None to use HISTORYLINKS_REDIRECT_CACHE_TIMEOUT.
+    "REDIRECT_SHARED_CACHE_TIMEOUT": None,
+    # Send a cacheable rescued redirect with Cache-Control: public.
+    "REDIRECT_CACHE_PUBLIC": False,
+    # Only rescue 404 responses for paths starting with one of these prefixes, or matching one
+    # of the include patterns. If both are empty, all paths are eligible.
+    "RESCUE_INCLUDE_PREFIXES": (),
+    # Only rescue 404 responses for paths matching one of these regular expressions.
+    "RESCUE_INCLUDE_PATTERNS": (),
+    # Never rescue 404 responses for paths starting with one of these prefixes, such as "/static/".
+    "RESCUE_EXCLUDE_PREFIXES": (),
+    # Never rescue 404 responses for paths matching one of these regular expressions.
+    "RESCUE_EXCLUDE_PATTERNS": (),
+}
+
+
+def get_setting(name):
+    """Returns the value of the given HISTORYLINKS_* setting."""
+    return getattr(settings, "HISTORYLINKS_" + name, DEFAULTS[name])
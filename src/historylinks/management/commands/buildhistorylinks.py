@@ -1,36 +1,240 @@
-from django.core.management.base import BaseCommand
-from django.db import transaction
+from argparse import ArgumentTypeError
+from datetime import datetime, time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import chain
 
-from historylinks.registration import default_history_link_manager, _bulk_save_history_links
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.encoding import force_str
+
+from historylinks.models import HistoryLinkBuildCheckpoint
+from historylinks.registration import default_history_link_manager, _bulk_save_history_links, _iter_object_batches
+
+
+# The number of objects to load at once, if no batch size is given.
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _parse_since(value):
+    """Parses the --since option as a date or datetime."""
+    since = parse_datetime(value)
+    if since is None:
+        since_date = parse_date(value)
+        if since_date is None:
+            raise ArgumentTypeError("{value!r} is not a valid date or datetime.".format(
+                value=value,
+            ))
+        since = datetime.combine(since_date, time.min)
+    if settings.USE_TZ and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def _get_queryset(model, since=None):
+    """
+    Returns a queryset of the objects to build history links for.
+
+    If since is given, and the model has an auto_now field, only objects modified since
+    then are returned.
+    """
+    queryset = default_history_link_manager.get_adapter(model).prepare_queryset(model._default_manager.all())
+    if since is not None:
+        for field in model._meta.concrete_fields:
+            if getattr(field, "auto_now", False):
+                return queryset.filter(**{field.name + "__gte": since})
+    return queryset
+
+
+def _build_history_links(queryset, batch_size, atomic_batches, checkpoint=None, last_pk=None):
+    """
+    Builds the history links for the given queryset, yielding each batch of objects.
+
+    If a checkpoint is given, it is updated with the progress of each batch.
+    """
+    for objs in _iter_object_batches(queryset, batch_size, last_pk):
+        history_links = list(default_history_link_manager._iter_objs_history_links(objs))
+        with transaction.atomic() if atomic_batches else nullcontext():
+            _bulk_save_history_links(history_links)
+            if checkpoint is not None:
+                checkpoint.last_object_id = force_str(objs[-1].pk)
+                checkpoint.save()
+        yield objs
+
+
+def _get_shards(model, shard_count):
+    """
+    Splits the given model into a list of (model_label, min_pk, max_pk) shards.
+
+    Models with a non-integer primary key are not split.
+    """
+    model_label = model._meta.label
+    if shard_count > 1 and isinstance(model._meta.pk, models.IntegerField):
+        pk_range = model._default_manager.aggregate(min_pk=models.Min("pk"), max_pk=models.Max("pk"))
+        min_pk, max_pk = pk_range["min_pk"], pk_range["max_pk"]
+        if min_pk is None:
+            return []
+        shard_size = (max_pk - min_pk) // shard_count + 1
+        return [
+            (model_label, shard_min_pk, min(shard_min_pk + shard_size - 1, max_pk))
+            for shard_min_pk in range(min_pk, max_pk + 1, shard_size)
+        ]
+    return [(model_label, None, None)]
+
+
+def _init_worker():
+    """Prepares a worker process, giving it its own database connections."""
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+
+
+def _build_shard(model_label, min_pk, max_pk, batch_size, since):
+    """Builds the history links for a single shard in a worker process, returning the number of objects."""
+    queryset = _get_queryset(apps.get_model(model_label), since)
+    if min_pk is not None:
+        queryset = queryset.filter(pk__gte=min_pk, pk__lte=max_pk)
+    return model_label, sum(len(objs) for objs in _build_history_links(queryset, batch_size, True))
 
 
 class Command(BaseCommand):
 
     help = "Builds the history links for all registered models."
 
-    @transaction.atomic()
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help=(
+                "Save and commit the history links for this many objects at a time. "
+                "By default, all history links are saved in a single transaction."
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help=(
+                "Build the history links in this many worker processes, splitting each model by primary key. "
+                "Each batch is committed separately, and per-object output is not reported."
+            ),
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            default=False,
+            help=(
+                "Resume an interrupted run, skipping models and objects that have already been processed. "
+                "Each batch is committed separately."
+            ),
+        )
+        parser.add_argument(
+            "--since",
+            type=_parse_since,
+            default=None,
+            help="Only build history links for objects modified since this date, for models with an auto_now field.",
+        )
+
     def handle(self, *args, **options):
         verbosity = int(options.get("verbosity", 1))
-        link_count = 0
-        # Create links.
-        links_to_create = []
-        for model in default_history_link_manager.get_registered_models():
-            local_link_count = 0
-            for obj in model._default_manager.all().iterator():
-                local_link_count += 1
-                links_to_create.extend(default_history_link_manager._update_obj_history_links_iter(obj))
-                if verbosity == 3:
-                    self.stdout.write("Refreshed history link for {obj}.".format(
-                        obj=obj,
-                    ))
-            if verbosity == 2:
-                self.stdout.write("Refreshed {local_link_count} history link(s) for {model}.".format(
-                    local_link_count=local_link_count,
-                    model=model._meta.verbose_name,
-                ))
-            link_count += local_link_count
-        _bulk_save_history_links(links_to_create)
+        batch_size = options.get("batch_size")
+        workers = options.get("workers") or 1
+        resume = options.get("resume", False)
+        since = options.get("since")
+        if workers < 1:
+            raise CommandError("--workers must be at least 1.")
+        if workers > 1:
+            if resume:
+                raise CommandError("--resume cannot be used with --workers.")
+            link_count = self._build_history_links_parallel(verbosity, batch_size, workers, since)
+        else:
+            # Without a batch size, the whole run is a single transaction. Otherwise, progress
+            # is recorded after each batch, so the run can be resumed.
+            use_checkpoints = bool(batch_size) or resume
+            with nullcontext() if use_checkpoints else transaction.atomic():
+                link_count = self._build_history_links(verbosity, batch_size, use_checkpoints, resume, since)
         if verbosity == 1:
             self.stdout.write("Refreshed {link_count} history links.".format(
                 link_count=link_count,
             ))
+
+    def _write_model_link_count(self, verbosity, model, local_link_count):
+        if verbosity == 2:
+            self.stdout.write("Refreshed {local_link_count} history link(s) for {model}.".format(
+                local_link_count=local_link_count,
+                model=model._meta.verbose_name,
+            ))
+
+    def _reset_checkpoints(self, models):
+        # Reset every model up front, so an interrupted run cannot leave later models marked as complete.
+        HistoryLinkBuildCheckpoint.objects.filter(
+            content_type__in=list(ContentType.objects.get_for_models(*models).values()),
+        ).update(
+            last_object_id="",
+            is_complete=False,
+        )
+
+    def _get_checkpoint(self, model):
+        content_type = ContentType.objects.get_for_model(model)
+        return HistoryLinkBuildCheckpoint.objects.get_or_create(content_type=content_type)[0]
+
+    def _build_history_links(self, verbosity, batch_size, use_checkpoints, resume, since):
+        link_count = 0
+        registered_models = list(default_history_link_manager.get_registered_models())
+        if use_checkpoints and not resume:
+            self._reset_checkpoints(registered_models)
+        for model in registered_models:
+            local_link_count = 0
+            checkpoint = None
+            last_pk = None
+            if use_checkpoints:
+                checkpoint = self._get_checkpoint(model)
+                if checkpoint.is_complete:
+                    self._write_model_link_count(verbosity, model, local_link_count)
+                    continue
+                if checkpoint.last_object_id:
+                    last_pk = model._meta.pk.to_python(checkpoint.last_object_id)
+            for objs in _build_history_links(
+                _get_queryset(model, since),
+                batch_size or DEFAULT_BATCH_SIZE,
+                use_checkpoints,
+                checkpoint,
+                last_pk,
+            ):
+                local_link_count += len(objs)
+                if verbosity == 3:
+                    for obj in objs:
+                        self.stdout.write("Refreshed history link for {obj}.".format(
+                            obj=obj,
+                        ))
+            if checkpoint is not None:
+                checkpoint.is_complete = True
+                checkpoint.save()
+            self._write_model_link_count(verbosity, model, local_link_count)
+            link_count += local_link_count
+        return link_count
+
+    def _build_history_links_parallel(self, verbosity, batch_size, workers, since):
+        registered_models = list(default_history_link_manager.get_registered_models())
+        shards = list(chain.from_iterable(_get_shards(model, workers) for model in registered_models))
+        # Worker processes must not share the parent's database connections.
+        connections.close_all()
+        local_link_counts = dict.fromkeys((model._meta.label for model in registered_models), 0)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            futures = [
+                executor.submit(_build_shard, model_label, min_pk, max_pk, batch_size or DEFAULT_BATCH_SIZE, since)
+                for model_label, min_pk, max_pk in shards
+            ]
+            for future in futures:
+                model_label, local_link_count = future.result()
+                local_link_counts[model_label] += local_link_count
+        for model in registered_models:
+            self._write_model_link_count(verbosity, model, local_link_counts[model._meta.label])
+        return sum(local_link_counts.values())
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from historylinks.models import HistoryLink
+from historylinks.registration import default_history_link_manager
+
+
+class Command(BaseCommand):
+
+    help = "Rewrites chains of history links to point directly at the object at the end of the chain."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Process and commit this many history links at a time.",
+        )
+        parser.add_argument(
+            "--max-depth",
+            type=int,
+            default=5,
+            help="The maximum number of history links to follow in each chain.",
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity", 1))
+        batch_size = options["batch_size"]
+        link_count = 0
+        last_pk = 0
+        while True:
+            history_links = list(HistoryLink.objects.filter(pk__gt=last_pk).order_by("pk")[:batch_size])
+            if not history_links:
+                break
+            with transaction.atomic():
+                local_link_count = default_history_link_manager.collapse_history_links(history_links, options["max_depth"])
+            last_pk = history_links[-1].pk
+            link_count += local_link_count
+            if verbosity == 2:
+                self.stdout.write("Collapsed {local_link_count} history link(s).".format(
+                    local_link_count=local_link_count,
+                ))
+        if verbosity == 1:
+            self.stdout.write("Collapsed {link_count} history links.".format(
+                link_count=link_count,
+            ))
@@ -0,0 +1,158 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from historylinks.management.commands.buildhistorylinks import _parse_since
+from historylinks.models import GONE, HistoryLink
+from historylinks.registration import default_history_link_manager
+
+
+# Source values with a special meaning in an nginx map block, which must be escaped.
+NGINX_MAP_PARAMETERS = frozenset(("default", "hostnames", "include", "volatile"))
+
+
+def _quote_nginx(value):
+    """Returns the given value as a quoted nginx string."""
+    return '"{value}"'.format(
+        value=value.replace("\\", "\\\\").replace('"', '\\"'),
+    )
+
+
+def _format_nginx(permalink, current_url, updated):
+    """
+    Returns an entry for an nginx map block, or None if the entry is not a redirect, or cannot
+    be represented.
+
+    Tombstones are not exported, as a map can only return a value.
+    """
+    if current_url in (permalink, GONE):
+        return None
+    # Variables and line breaks cannot be escaped.
+    if "$" in current_url or any(char in permalink + current_url for char in "\r\n"):
+        return None
+    # Escape source values that would be treated as a regular expression or a parameter.
+    if permalink.startswith("~") or permalink in NGINX_MAP_PARAMETERS:
+        permalink = "\\" + permalink
+    return "{permalink} {current_url};\n".format(
+        permalink=_quote_nginx(permalink),
+        current_url=_quote_nginx(current_url),
+    )
+
+
+def _format_rewritemap(permalink, current_url, updated):
+    """
+    Returns an entry for a plain text rewrite map, or None if the entry is not a redirect, or
+    cannot be represented.
+
+    Tombstones are not exported, as a rewrite map can only return a value.
+    """
+    if current_url in (permalink, GONE) or len((permalink + " " + current_url).split()) != 2:
+        return None
+    return "{permalink} {current_url}\n".format(
+        permalink=permalink,
+        current_url=current_url,
+    )
+
+
+def _format_jsonl(permalink, current_url, updated):
+    """
+    Returns an entry as a line of JSON.
+
+    Tombstones, and history links that are no longer redirects, are included, so that an
+    incremental export can remove them.
+    """
+    gone = current_url == GONE
+    return json.dumps({
+        "permalink": permalink,
+        "current_url": None if gone else current_url,
+        "gone": gone,
+        "updated": updated.isoformat(),
+    }) + "\n"
+
+
+FORMATS = {
+    "nginx": _format_nginx,
+    "rewritemap": _format_rewritemap,
+    "jsonl": _format_jsonl,
+}
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Exports the history links of registered models, resolved to their current URLs, as a redirect map "
+        "that can be loaded by a front proxy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            choices=sorted(FORMATS),
+            default="nginx",
+            help=(
+                "The format of the export. nginx writes the entries of an nginx map block, rewritemap writes a "
+                "plain text rewrite map, and jsonl writes a JSON object per line, including tombstones."
+            ),
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Write the export to this file. By default, the export is written to stdout.",
+        )
+        parser.add_argument(
+            "--since",
+            type=_parse_since,
+            default=None,
+            help=(
+                "Only export history links updated since this date. Changes to the current URLs of older history "
+                "links are only included if HISTORYLINKS_STORE_CURRENT_URL is enabled."
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Load and resolve this many history links at a time.",
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity", 1))
+        batch_size = options["batch_size"]
+        format_entry = FORMATS[options["format"]]
+        # Record when the export started, for use as --since in the next export.
+        started = timezone.now()
+        queryset = HistoryLink.objects.all()
+        if options["since"] is not None:
+            queryset = queryset.filter(updated__gte=options["since"])
+        output = open(options["output"], "w", encoding="utf-8") if options["output"] else self.stdout
+        link_count = 0
+        try:
+            last_pk = 0
+            while True:
+                history_links = list(queryset.filter(pk__gt=last_pk).order_by("pk")[:batch_size])
+                if not history_links:
+                    break
+                last_pk = history_links[-1].pk
+                for history_link, current_url in default_history_link_manager._iter_history_links_current_urls(
+                    history_links,
+                ):
+                    # Skip history links that cannot be resolved.
+                    if current_url is None:
+                        continue
+                    entry = format_entry(history_link.permalink, current_url, history_link.updated)
+                    if entry is not None:
+                        output.write(entry)
+                        link_count += 1
+        finally:
+            if output is not self.stdout:
+                output.close()
+        if verbosity >= 1:
+            # Keep the summary out of an export written to stdout.
+            summary_output = self.stdout if options["output"] else self.stderr
+            summary_output.write(
+                "Exported {link_count} history links. Use --since={started} to export later changes.".format(
+                    link_count=link_count,
+                    started=started.isoformat(),
+                )
+            )
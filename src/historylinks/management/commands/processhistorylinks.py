@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from historylinks.backends import DatabaseBackend, get_backend
+from historylinks.registration import default_history_link_manager
+
+
+class Command(BaseCommand):
+
+    help = "Processes the deferred history link updates queued by historylinks.backends.DatabaseBackend."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Process and commit this many queued objects at a time.",
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity", 1))
+        backend = get_backend()
+        if not isinstance(backend, DatabaseBackend):
+            raise CommandError("HISTORYLINKS_DEFERRED_BACKEND is not a historylinks.backends.DatabaseBackend.")
+        object_count = 0
+        while True:
+            local_object_count = backend.process(default_history_link_manager, options["batch_size"])
+            if not local_object_count:
+                break
+            object_count += local_object_count
+            if verbosity == 2:
+                self.stdout.write("Processed {local_object_count} queued object(s).".format(
+                    local_object_count=local_object_count,
+                ))
+        if verbosity == 1:
+            self.stdout.write("Processed {object_count} queued objects.".format(
+                object_count=object_count,
+            ))
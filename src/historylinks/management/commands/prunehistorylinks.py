@@ -0,0 +1,90 @@
+from itertools import chain
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import Cast
+from django.utils.encoding import force_str
+
+from historylinks.conf import get_setting
+from historylinks.models import HistoryLink
+from historylinks.registration import default_history_link_manager, _delete_history_links, _tombstone_history_links
+
+
+def _get_orphaned_history_links(model, queryset):
+    """
+    Returns the history links in the given queryset of history links for the given model
+    whose objects no longer exist.
+
+    For models with an integer primary key, the orphans are found with an anti-join.
+    Otherwise, the primary keys of the history links are compared with the existing objects.
+    """
+    if isinstance(model._meta.pk, models.IntegerField):
+        return queryset.filter(~models.Exists(model._base_manager.filter(
+            pk=Cast(models.OuterRef("object_id"), output_field=models.BigIntegerField()),
+        )))
+    history_link_pks = {}
+    for object_id, pk in queryset.values_list("object_id", "pk"):
+        history_link_pks.setdefault(object_id, []).append(pk)
+    for pk in model._base_manager.filter(pk__in=[
+        model._meta.pk.to_python(object_id)
+        for object_id in history_link_pks
+    ]).values_list("pk", flat=True):
+        history_link_pks.pop(force_str(pk), None)
+    return queryset.filter(pk__in=list(chain.from_iterable(history_link_pks.values())))
+
+
+class Command(BaseCommand):
+
+    help = "Deletes, or marks as tombstones, the history links for objects of registered models that no longer exist."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Check and commit this many history links at a time.",
+        )
+        parser.add_argument(
+            "--tombstone",
+            action="store_true",
+            default=False,
+            help=(
+                "Mark the history links as tombstones, which answer 410 Gone, instead of deleting them. "
+                "This is the default if HISTORYLINKS_ON_DELETE is \"tombstone\"."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get("verbosity", 1))
+        batch_size = options["batch_size"]
+        if options["tombstone"] or get_setting("ON_DELETE") == "tombstone":
+            prune_history_links = _tombstone_history_links
+        else:
+            prune_history_links = _delete_history_links
+        link_count = 0
+        for model in default_history_link_manager.get_registered_models():
+            queryset = HistoryLink.objects.filter(content_type=ContentType.objects.get_for_model(model))
+            local_link_count = 0
+            last_pk = 0
+            while True:
+                # Find the last history link in the next chunk.
+                chunk_queryset = queryset.filter(pk__gt=last_pk)
+                upper_pks = list(chunk_queryset.order_by("pk").values_list("pk", flat=True)[batch_size - 1:batch_size])
+                if upper_pks:
+                    chunk_queryset = chunk_queryset.filter(pk__lte=upper_pks[0])
+                with transaction.atomic():
+                    local_link_count += prune_history_links(_get_orphaned_history_links(model, chunk_queryset))
+                if not upper_pks:
+                    break
+                last_pk = upper_pks[0]
+            if verbosity == 2:
+                self.stdout.write("Pruned {local_link_count} history link(s) for {model}.".format(
+                    local_link_count=local_link_count,
+                    model=model._meta.verbose_name,
+                ))
+            link_count += local_link_count
+        if verbosity == 1:
+            self.stdout.write("Pruned {link_count} history links.".format(
+                link_count=link_count,
+            ))
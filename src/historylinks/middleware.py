@@ -1,18 +1,66 @@
 """Middleware used by the history links service."""
 from __future__ import unicode_literals
 
+import hashlib
+import re
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseGone
 from django.shortcuts import redirect
-from django.utils.cache import add_never_cache_headers
+from django.utils.cache import add_never_cache_headers, patch_cache_control, patch_response_headers
+from django.utils.http import quote_etag
 from django.utils.deprecation import MiddlewareMixin
 
+from historylinks.conf import get_setting
+from historylinks.models import GONE
 from historylinks.registration import history_link_context_manager, default_history_link_manager
+from historylinks.signals import measure, response_rescued
 
 HISTORYLINK_MIDDLEWARE_FLAG = "_history_link_fallback_middleware_active"
 
 
+def _compile_patterns(patterns):
+    """Compiles the given regular expressions into a single pattern, or returns None if there are none."""
+    if not patterns:
+        return None
+    return re.compile("|".join("(?:{pattern})".format(pattern=pattern) for pattern in patterns))
+
+
 class HistoryLinkFallbackMiddleware(MiddlewareMixin):
 
-    """Middleware that attempts to rescue 404 responses with a redirect to it's new location."""
+    """
+    Middleware that attempts to rescue 404 responses with a redirect to it's new location, or
+    a 410 response if the object has been deleted, and its history links are tombstones.
+
+    Under ASGI, the middleware runs asynchronously, and looks up the redirect with
+    HistoryLinkManager.aget_current_url().
+
+    Only 404 responses for paths allowed by the HISTORYLINKS_RESCUE_* settings are rescued.
+    The settings are read once, when the middleware is created.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Initializes the middleware, compiling the rescue path settings."""
+        super().__init__(get_response)
+        self._include_prefixes = tuple(get_setting("RESCUE_INCLUDE_PREFIXES"))
+        self._include_pattern = _compile_patterns(get_setting("RESCUE_INCLUDE_PATTERNS"))
+        self._exclude_prefixes = tuple(get_setting("RESCUE_EXCLUDE_PREFIXES"))
+        self._exclude_pattern = _compile_patterns(get_setting("RESCUE_EXCLUDE_PATTERNS"))
+
+    def _is_rescuable(self, path):
+        """Returns True if a 404 response for the given path may be rescued."""
+        if self._include_prefixes or self._include_pattern is not None:
+            if not (
+                path.startswith(self._include_prefixes) or
+                (self._include_pattern is not None and self._include_pattern.match(path))
+            ):
+                return False
+        if path.startswith(self._exclude_prefixes):
+            return False
+        return self._exclude_pattern is None or not self._exclude_pattern.match(path)
 
     def process_request(self, request):
         """Starts a new history link context."""
@@ -30,15 +78,87 @@ class HistoryLinkFallbackMiddleware(MiddlewareMixin):
         # Close the history link context.
         self._close_history_link_context(request)
         # Attempt to rescue a 404 error.
-        if response.status_code == 404:
-            redirect_url = default_history_link_manager.get_current_url(request.path)
-            if redirect_url and redirect_url != request.path:
-                response = redirect(redirect_url, permanent=True)
-                add_never_cache_headers(response)
-                return response
+        if response.status_code == 404 and self._is_rescuable(request.path):
+            with measure(response_rescued, self.__class__) as measurement:
+                redirect_url = self._get_redirect_url(
+                    request,
+                    default_history_link_manager.get_current_url(request.path, gone=GONE),
+                    measurement,
+                )
+            if redirect_url is not None:
+                return self._get_rescue_response(request, redirect_url)
         # Return the original response.
         return response
 
+    async def __acall__(self, request):
+        """
+        Handles a request asynchronously, rescuing 404 responses without blocking the
+        event loop.
+        """
+        self.process_request(request)
+        response = await self.get_response(request)
+        # Close the history link context, saving any history links in a thread.
+        if history_link_context_manager.has_pending():
+            await sync_to_async(self._close_history_link_context, thread_sensitive=True)(request)
+        else:
+            self._close_history_link_context(request)
+        # Attempt to rescue a 404 error.
+        if response.status_code == 404 and self._is_rescuable(request.path):
+            with measure(response_rescued, self.__class__) as measurement:
+                redirect_url = self._get_redirect_url(
+                    request,
+                    await default_history_link_manager.aget_current_url(request.path, gone=GONE),
+                    measurement,
+                )
+            if redirect_url is not None:
+                return self._get_rescue_response(request, redirect_url)
+        # Return the original response.
+        return response
+
+    def _get_redirect_url(self, request, current_url, measurement):
+        """
+        Returns the URL to redirect the request to, GONE if the object that used to exist at
+        the requested path has been deleted, or None if the response cannot be rescued.
+        """
+        redirect_url = current_url if current_url and current_url != request.path else None
+        if measurement is not None:
+            measurement.kwargs.update(
+                request=request,
+                path=request.path,
+                redirect_url=None if redirect_url == GONE else redirect_url,
+                gone=redirect_url == GONE,
+            )
+        return redirect_url
+
+    def _get_rescue_response(self, request, redirect_url):
+        """Returns a permanent redirect to the given URL, or a 410 response if it is GONE."""
+        if redirect_url == GONE:
+            response = HttpResponseGone()
+            cache_timeout = get_setting("GONE_CACHE_TIMEOUT")
+            if cache_timeout is None:
+                add_never_cache_headers(response)
+            else:
+                patch_response_headers(response, cache_timeout)
+            return response
+        response = redirect(redirect_url, permanent=True)
+        response.status_code = get_setting("REDIRECT_STATUS")
+        cache_timeout = get_setting("REDIRECT_CACHE_TIMEOUT")
+        shared_cache_timeout = get_setting("REDIRECT_SHARED_CACHE_TIMEOUT")
+        if cache_timeout is None and shared_cache_timeout is None:
+            add_never_cache_headers(response)
+        else:
+            patch_response_headers(response, cache_timeout or 0)
+            if shared_cache_timeout is not None:
+                patch_cache_control(response, s_maxage=shared_cache_timeout)
+            if get_setting("REDIRECT_CACHE_PUBLIC"):
+                patch_cache_control(response, public=True)
+            # The ETag only changes when the redirect does.
+            response["ETag"] = quote_etag(hashlib.blake2b(
+                "{path}\n{redirect_url}".format(path=request.path, redirect_url=redirect_url).encode("utf-8"),
+                digest_size=16,
+            ).hexdigest())
+        return response
+
     def process_exception(self, request, exception):
         """Closes the history link context."""
         history_link_context_manager.invalidate()
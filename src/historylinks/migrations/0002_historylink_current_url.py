@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('historylinks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historylink',
+            name='current_url',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('historylinks', '0002_historylink_current_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryLinkBuildCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_object_id', models.TextField(blank=True)),
+                ('is_complete', models.BooleanField(default=False)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('content_type', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('historylinks', '0004_historylinkqueueitem'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historylink',
+            name='object_id',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='historylink',
+            index=models.Index(fields=['content_type', 'object_id'], name='historylinks_content_obj_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def get_permalink_hash(permalink):
+    return int.from_bytes(
+        hashlib.blake2b(permalink.encode("utf-8"), digest_size=8).digest(),
+        "big",
+        signed=True,
+    )
+
+
+def populate_permalink_hash(apps, schema_editor):
+    HistoryLink = apps.get_model("historylinks", "HistoryLink")
+    history_links = []
+    for history_link in HistoryLink.objects.using(schema_editor.connection.alias).only("permalink").iterator():
+        history_link.permalink_hash = get_permalink_hash(history_link.permalink)
+        history_links.append(history_link)
+        if len(history_links) >= 1000:
+            HistoryLink.objects.using(schema_editor.connection.alias).bulk_update(history_links, ["permalink_hash"])
+            history_links = []
+    HistoryLink.objects.using(schema_editor.connection.alias).bulk_update(history_links, ["permalink_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('historylinks', '0005_historylink_object_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historylink',
+            name='permalink_hash',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(populate_permalink_hash, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='historylink',
+            name='permalink_hash',
+            field=models.BigIntegerField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='historylink',
+            name='permalink',
+            field=models.TextField(),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('historylinks', '0006_historylink_permalink_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historylink',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('historylinks', '0007_historylink_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historylink',
+            name='deleted',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
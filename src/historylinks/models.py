@@ -1,7 +1,71 @@
 """Models used by django-historylinks."""
+import hashlib
+
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.db import models
+from django.db.models.functions import Cast
+from django.utils.encoding import force_str
+
+
+# Used in place of the current URL of a history link whose object has been deleted, when
+# resolving, caching or mapping history links.
+GONE = "historylinks:gone"
+
+
+def get_permalink_hash(permalink):
+    """Returns the signed 64-bit hash of the given permalink, used to look up history links."""
+    return int.from_bytes(
+        hashlib.blake2b(permalink.encode("utf-8"), digest_size=8).digest(),
+        "big",
+        signed=True,
+    )
+
+
+class HistoryLinkQuerySet(models.QuerySet):
+
+    """A queryset of history links."""
+
+    def for_permalink(self, permalink):
+        """Returns the history link for the given permalink, using the permalink hash index."""
+        return self.filter(
+            permalink_hash=get_permalink_hash(permalink),
+            permalink=permalink,
+        )
+
+    def for_object(self, obj):
+        """Returns the history links for the given obj."""
+        return self.filter(
+            content_type=ContentType.objects.get_for_model(obj),
+            object_id=force_str(obj.pk),
+        )
+
+    def for_objects(self, objects):
+        """
+        Returns the history links for the given objects.
+
+        If objects is a queryset of a model with an integer primary key, it is used as a
+        subquery. Otherwise, the objects are grouped by model, and looked up in a single query.
+        """
+        if isinstance(objects, models.QuerySet):
+            model = objects.model
+            if isinstance(model._meta.pk, models.IntegerField):
+                object_ids = objects.order_by().annotate(
+                    historylinks_object_id=Cast("pk", output_field=models.CharField(max_length=255)),
+                ).values("historylinks_object_id")
+            else:
+                object_ids = [force_str(pk) for pk in objects.values_list("pk", flat=True)]
+            return self.filter(
+                content_type=ContentType.objects.get_for_model(model),
+                object_id__in=object_ids,
+            )
+        object_ids = {}
+        for obj in objects:
+            object_ids.setdefault(ContentType.objects.get_for_model(obj), set()).add(force_str(obj.pk))
+        query = models.Q(pk__in=())
+        for content_type, content_type_object_ids in object_ids.items():
+            query |= models.Q(content_type=content_type, object_id__in=content_type_object_ids)
+        return self.filter(query)
 
 
 class HistoryLink(models.Model):
@@ -12,20 +76,102 @@ class HistoryLink(models.Model):
         max_length=255,
     )
 
-    permalink = models.CharField(
-        max_length=255,
+    permalink = models.TextField()
+
+    permalink_hash = models.BigIntegerField(
         unique=True,
     )
 
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
 
-    object_id = models.TextField()
+    object_id = models.CharField(
+        max_length=255,
+    )
 
     object = GenericForeignKey()
 
+    current_url = models.TextField(
+        blank=True,
+        default="",
+    )
+
+    updated = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+    )
+
+    deleted = models.DateTimeField(
+        blank=True,
+        null=True,
+        default=None,
+    )
+
+    objects = HistoryLinkQuerySet.as_manager()
+
     def __str__(self):
         """Returns a unicode representation."""
         return self.permalink
 
+    def save(self, *args, **kwargs):
+        """Saves the history link, updating the permalink hash."""
+        self.permalink_hash = get_permalink_hash(self.permalink)
+        super().save(*args, **kwargs)
+
+    class Meta:
+        app_label = "historylinks"
+        indexes = (
+            models.Index(
+                fields=("content_type", "object_id"),
+                name="historylinks_content_obj_idx",
+            ),
+        )
+
+
+class HistoryLinkBuildCheckpoint(models.Model):
+
+    """The progress of the buildhistorylinks command for a model."""
+
+    content_type = models.OneToOneField(ContentType, on_delete=models.CASCADE)
+
+    last_object_id = models.TextField(
+        blank=True,
+    )
+
+    is_complete = models.BooleanField(
+        default=False,
+    )
+
+    updated = models.DateTimeField(
+        auto_now=True,
+    )
+
+    def __str__(self):
+        """Returns a unicode representation."""
+        return str(self.content_type)
+
+    class Meta:
+        app_label = "historylinks"
+
+
+class HistoryLinkQueueItem(models.Model):
+
+    """An object waiting for its history links to be updated by the processhistorylinks command."""
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+
+    object_id = models.CharField(
+        max_length=255,
+    )
+
+    def __str__(self):
+        """Returns a unicode representation."""
+        return "{content_type} {object_id}".format(
+            content_type=self.content_type,
+            object_id=self.object_id,
+        )
+
     class Meta:
         app_label = "historylinks"
+        unique_together = (
+            ("content_type", "object_id"),
+        )
@@ -0,0 +1,126 @@
+"""An in-memory map of permalinks to current URLs."""
+import sys
+import time
+from datetime import timedelta
+from threading import Lock
+
+from historylinks.conf import get_setting
+from historylinks.models import GONE, HistoryLink
+
+
+# Stored in place of the current URL of a history link that has no stored current URL.
+UNRESOLVED = "historylinks:unresolved"
+
+
+class RedirectMap(object):
+
+    """
+    An in-memory map of permalinks to the current URLs stored on their history links.
+
+    The map is loaded on first use, and refreshed incrementally every refresh_interval
+    seconds with the history links updated since the last refresh. Once loaded, a path
+    missing from the map is not a history link, so is not looked up in the database.
+
+    An incremental refresh cannot see history links deleted in other processes, so the
+    map is loaded again in full every reload_interval seconds. History links deleted in
+    this process are removed from the map immediately.
+    """
+
+    def __init__(self, refresh_interval, reload_interval):
+        """Initializes the redirect map."""
+        self._refresh_interval = refresh_interval
+        self._reload_interval = reload_interval
+        self._lock = Lock()
+        self.reload()
+
+    def reload(self):
+        """Discards the map, so it is loaded again in full on next use."""
+        with self._lock:
+            self._current_urls = {}
+            self._last_updated = None
+            self._next_refresh = 0
+            self._next_reload = 0
+
+    def refresh(self):
+        """Loads the history links updated since the last refresh."""
+        with self._lock:
+            self._refresh()
+
+    def discard(self, paths):
+        """Removes the given paths from the map."""
+        with self._lock:
+            for path in paths:
+                self._current_urls.pop(path, None)
+
+    def _refresh(self):
+        """Loads the history links updated since the last refresh, with the lock held."""
+        queryset = HistoryLink.objects.all()
+        now = time.monotonic()
+        if self._last_updated is not None and now < self._next_reload:
+            # Overlap with the previous refresh, to catch history links committed after
+            # the refresh, but with an earlier update time.
+            self._load(queryset.filter(
+                updated__gte=self._last_updated - timedelta(seconds=self._refresh_interval),
+            ), self._current_urls)
+        else:
+            # Build a new map, so lookups continue against the old map while it loads.
+            self._last_updated = None
+            current_urls = {}
+            self._load(queryset, current_urls)
+            self._current_urls = current_urls
+            self._next_reload = now + self._reload_interval
+        self._next_refresh = now + self._refresh_interval
+
+    def _load(self, queryset, current_urls):
+        """Loads the history links in the given queryset into the given map."""
+        last_updated = self._last_updated
+        for permalink, current_url, updated, deleted in queryset.values_list(
+            "permalink",
+            "current_url",
+            "updated",
+            "deleted",
+        ).iterator():
+            if deleted is not None:
+                current_url = GONE
+            elif current_url:
+                current_url = sys.intern(current_url)
+            else:
+                current_url = UNRESOLVED
+            current_urls[sys.intern(permalink)] = current_url
+            if last_updated is None or updated > last_updated:
+                last_updated = updated
+        self._last_updated = last_updated
+
+    def is_stale(self):
+        """Checks whether the map is due to be refreshed."""
+        return time.monotonic() >= self._next_refresh
+
+    def get(self, path, refresh=True):
+        """
+        Returns the current URL for the given path, GONE if its history link is a tombstone,
+        UNRESOLVED if its history link has no stored current URL, or None if it is not a
+        history link.
+
+        If refresh is True, the map is refreshed first if it is stale.
+        """
+        if refresh and self.is_stale():
+            with self._lock:
+                if self.is_stale():
+                    self._refresh()
+        return self._current_urls.get(path)
+
+
+_redirect_map = None
+
+
+def get_redirect_map():
+    """Returns the shared redirect map, or None if the redirect map is disabled."""
+    global _redirect_map
+    if not get_setting("REDIRECT_MAP"):
+        return None
+    if _redirect_map is None:
+        _redirect_map = RedirectMap(
+            get_setting("REDIRECT_MAP_REFRESH_INTERVAL"),
+            get_setting("REDIRECT_MAP_RELOAD_INTERVAL"),
+        )
+    return _redirect_map
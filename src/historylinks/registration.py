@@ -1,17 +1,31 @@
 """Adapters for registering models with django-HistoryLinks."""
 from __future__ import unicode_literals
 
+import logging
 import sys
+from contextvars import ContextVar, copy_context
 from itertools import chain
-from threading import local
-from functools import wraps
+from operator import methodcaller, or_
+from functools import reduce, wraps
 
+from asgiref.sync import sync_to_async
 from django.core.signals import request_finished
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import post_save
+from django.db import connections, router, transaction
+from django.db.models import Case, Q, QuerySet, TextField, Value, When, prefetch_related_objects
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
 from django.utils.encoding import force_str
 
-from historylinks.models import HistoryLink
+from historylinks.backends import get_backend
+from historylinks.cache import aget_cached_current_url, get_cache, get_cached_current_url, invalidate_current_urls
+from historylinks.conf import get_setting
+from historylinks.models import GONE, HistoryLink, get_permalink_hash
+from historylinks.redirect_map import UNRESOLVED, get_redirect_map
+from historylinks.signals import current_url_resolved, history_links_saved, measure
+
+
+logger = logging.getLogger("historylinks")
 
 
 class HistoryLinkAdapterError(Exception):
@@ -26,33 +40,81 @@ class HistoryLinkAdapter(object):
     # Use to specify the methods that should be used to generate permalinks.
     permalink_methods = ()
 
+    # Use to specify the fields used to generate permalinks. If specified, saves that
+    # only update other fields will not update the history links.
+    permalink_fields = None
+
+    # Use to specify the related objects used to generate permalinks, which will be loaded
+    # with select_related() or prefetch_related() when generating permalinks in bulk.
+    select_related = ()
+    prefetch_related = ()
+
     def __init__(self, model):
-        """Initializes the history link adapter."""
-        self.model = model
+        """
+        Initializes the history link adapter.
 
-    def get_permalinks(self, obj):
-        """Returns a dictionary of permalinks for the given obj."""
-        permalink_methods = self.permalink_methods or ("get_absolute_url",)
-        permalinks = {}
-        for permalink_method_name in permalink_methods:
+        The permalink methods are checked against the model once, so errors are raised
+        when the model is registered.
+        """
+        self.model = model
+        permalink_getters = []
+        for permalink_method_name in self.permalink_methods or ("get_absolute_url",):
             # Resolve the method.
             try:
-                permalink_method = getattr(obj, permalink_method_name)
+                permalink_method = getattr(model, permalink_method_name)
             except AttributeError:
-                raise HistoryLinkAdapterError("Could not find a method called {name!r} on {obj!r}".format(
+                raise HistoryLinkAdapterError("Could not find a method called {name!r} on {model}".format(
                     name=permalink_method_name,
-                    obj=obj,
+                    model=model.__name__,
                 ))
-            # Get the permalink.
             if not callable(permalink_method):
                 raise HistoryLinkAdapterError("{model}.{method} is not a callable method".format(
-                    model=self.model.__name__,
+                    model=model.__name__,
                     method=permalink_method_name,
                 ))
-            permalink = permalink_method()
-            permalinks[permalink_method_name] = permalink
-        # Return the resolved permalink.
-        return permalinks
+            # Look the method up on each obj, to respect static methods and subclass overrides.
+            permalink_getters.append((permalink_method_name, methodcaller(permalink_method_name)))
+        self._permalink_getters = tuple(permalink_getters)
+        # Respect subclasses that override get_permalinks().
+        self._overrides_get_permalinks = type(self).get_permalinks is not HistoryLinkAdapter.get_permalinks
+
+    def _get_permalink_items(self, obj):
+        """Returns a tuple of (permalink_name, permalink) from the permalink methods of the given obj."""
+        return tuple(
+            (permalink_method_name, permalink_getter(obj))
+            for permalink_method_name, permalink_getter in self._permalink_getters
+        )
+
+    def get_permalinks(self, obj):
+        """Returns a dictionary of permalinks for the given obj."""
+        return dict(self._get_permalink_items(obj))
+
+    def get_permalink_items(self, obj):
+        """Returns a tuple of (permalink_name, permalink) for the given obj."""
+        if self._overrides_get_permalinks:
+            return tuple(self.get_permalinks(obj).items())
+        return self._get_permalink_items(obj)
+
+    def prepare_queryset(self, queryset):
+        """Returns the given queryset, loading the related objects used to generate permalinks."""
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset
+
+    def get_permalinks_bulk(self, objs):
+        """
+        Returns a list of (obj, permalink_items) for the given objs.
+
+        Any related objects used to generate permalinks that have not already been loaded are
+        prefetched, using a constant number of queries.
+        """
+        objs = list(objs)
+        related_lookups = tuple(self.select_related) + tuple(self.prefetch_related)
+        if related_lookups:
+            prefetch_related_objects(objs, *related_lookups)
+        return [(obj, self.get_permalink_items(obj)) for obj in objs]
 
 
 class RegistrationError(Exception):
@@ -65,64 +127,349 @@ class HistoryLinkContextError(Exception):
     """Something went wrong with the HistoryLink context management."""
 
 
+def _iter_batches(connection, fields, objs):
+    """Splits the given list of objs into batches small enough to be used as query parameters."""
+    batch_size = max(connection.ops.bulk_batch_size(fields, objs), 1)
+    for start in range(0, len(objs), batch_size):
+        yield objs[start:start + batch_size]
+
+
+def _group_object_ids(history_links):
+    """Returns a dict of content type IDs to lists of object IDs for the given history links."""
+    object_ids = {}
+    for history_link in history_links:
+        object_ids.setdefault(history_link.content_type_id, set()).add(history_link.object_id)
+    return {content_type_id: list(ids) for content_type_id, ids in object_ids.items()}
+
+
+def _iter_object_batches(queryset, batch_size, last_pk=None):
+    """Yields lists of objects from the given queryset, paginated by primary key."""
+    queryset = queryset.order_by("pk")
+    while True:
+        batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        batch = list(batch_queryset[:batch_size].iterator(chunk_size=batch_size))
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        last_pk = batch[-1].pk
+
+
 def _bulk_save_history_links(history_links):
-    """Creates the given history link data in the most efficient way possible."""
+    """
+    Saves the given history link data in the most efficient way possible, returning
+    the number of history links written.
+
+    Any existing history links with the same permalink hash are updated in place, and
+    unchanged history links are not written, so the number of queries issued does
+    not depend on the number of history links. The cached current URLs of the objects
+    are evicted even if none of their history links were written, as an object can move
+    back to one of its older permalinks.
+    """
+    # Later history links for the same permalink take precedence.
+    history_links = list({
+        history_link.permalink_hash: history_link
+        for history_link in history_links
+    }.values())
+    if not history_links:
+        return 0
+    # Saving a history link clears any tombstone.
+    update_fields = ("permalink", "permalink_name", "content_type", "object_id", "deleted")
+    store_current_url = get_setting("STORE_CURRENT_URL")
+    if store_current_url:
+        update_fields += ("current_url",)
+    update_attnames = [HistoryLink._meta.get_field(field).attname for field in update_fields]
+    connection = connections[router.db_for_write(HistoryLink)]
+    # Skip any history links that are unchanged.
+    existing_history_links = _get_existing_history_links(connection, history_links, update_attnames)
+    saved_history_links = history_links
+    history_links = [
+        history_link
+        for history_link in history_links
+        if existing_history_links.get(history_link.permalink_hash, (None, None))[1] != tuple(
+            getattr(history_link, attname)
+            for attname in update_attnames
+        )
+    ]
     if history_links:
-        if hasattr(HistoryLink.objects, "bulk_create"):
-            HistoryLink.objects.bulk_create(history_links)
+        _write_history_links(connection, history_links, update_fields, existing_history_links, store_current_url)
+    # Evict the saved history links, and all other history links for the same objects.
+    cache = get_cache()
+    if cache is not None:
+        invalidate_current_urls(cache, _get_object_permalinks(connection, saved_history_links))
+    return len(history_links)
+
+
+def _write_history_links(connection, history_links, update_fields, existing_history_links, store_current_url):
+    """Writes the given changed history links."""
+    # Record when the history links were changed.
+    updated = timezone.now()
+    for history_link in history_links:
+        history_link.updated = updated
+    update_fields += ("updated",)
+    # Use a native upsert, if supported.
+    if getattr(connection.features, "supports_update_conflicts_with_target", False):
+        HistoryLink.objects.bulk_create(
+            history_links,
+            update_conflicts=True,
+            unique_fields=("permalink_hash",),
+            update_fields=update_fields,
+        )
+    else:
+        _bulk_update_or_create_history_links(history_links, update_fields, existing_history_links)
+    # Point the older history links for each object at its current URL.
+    if store_current_url:
+        _bulk_update_current_urls(connection, history_links, updated)
+
+
+def _get_existing_history_links(connection, history_links, attnames):
+    """
+    Returns a dict of permalink hashes to (pk, field_values) for the existing history links with
+    the same permalink hashes as the given history links.
+    """
+    existing_history_links = {}
+    for batch in _iter_batches(connection, ("permalink_hash",), history_links):
+        for pk, permalink_hash, *field_values in HistoryLink.objects.filter(
+            permalink_hash__in=[history_link.permalink_hash for history_link in batch],
+        ).values_list("pk", "permalink_hash", *attnames):
+            existing_history_links[permalink_hash] = (pk, tuple(field_values))
+    return existing_history_links
+
+
+def _bulk_update_or_create_history_links(history_links, update_fields, existing_history_links):
+    """Saves the given history links on databases that do not support a native upsert."""
+    links_to_update = []
+    links_to_create = []
+    for history_link in history_links:
+        if history_link.permalink_hash in existing_history_links:
+            history_link.pk = existing_history_links[history_link.permalink_hash][0]
+            links_to_update.append(history_link)
         else:
-            for history_link in history_links:
-                history_link.save()
+            links_to_create.append(history_link)
+    if links_to_update:
+        HistoryLink.objects.bulk_update(links_to_update, update_fields)
+    if links_to_create:
+        HistoryLink.objects.bulk_create(links_to_create)
+
+
+def _bulk_update_current_urls(connection, history_links, updated):
+    """Updates the current URL of all history links for the objects of the given history links."""
+    current_urls = {}
+    for history_link in history_links:
+        current_urls.setdefault((history_link.content_type_id, history_link.permalink_name), {})[
+            history_link.object_id
+        ] = history_link.current_url
+    for (content_type_id, permalink_name), object_current_urls in current_urls.items():
+        object_current_urls = list(object_current_urls.items())
+        for batch in _iter_batches(connection, ("object_id", "object_id", "current_url"), object_current_urls):
+            HistoryLink.objects.filter(
+                content_type_id=content_type_id,
+                permalink_name=permalink_name,
+                object_id__in=[object_id for object_id, _ in batch],
+            ).update(
+                current_url=Case(
+                    *[
+                        When(object_id=object_id, then=Value(current_url))
+                        for object_id, current_url in batch
+                    ],
+                    output_field=TextField(),
+                ),
+                updated=updated,
+            )
+
+
+def _get_object_permalinks(connection, history_links):
+    """Returns the permalinks of the given history links, and of all other history links for the same objects."""
+    permalinks = {history_link.permalink for history_link in history_links}
+    for content_type_id, object_ids in _group_object_ids(history_links).items():
+        for batch in _iter_batches(connection, ("object_id",), object_ids):
+            permalinks.update(HistoryLink.objects.filter(
+                content_type_id=content_type_id,
+                object_id__in=batch,
+            ).values_list("permalink", flat=True))
+    return permalinks
+
+
+def _delete_history_links(queryset):
+    """
+    Deletes the given history links, evicting them from the cache and the redirect map, and
+    returns the number deleted.
+    """
+    cache = get_cache()
+    redirect_map = get_redirect_map()
+    if cache is not None or redirect_map is not None:
+        permalinks = list(queryset.values_list("permalink", flat=True))
+        if cache is not None:
+            invalidate_current_urls(cache, permalinks)
+        if redirect_map is not None:
+            redirect_map.discard(permalinks)
+    return queryset.delete()[0]
+
+
+def _tombstone_history_links(queryset):
+    """
+    Marks the given history links as tombstones for a deleted object, evicting them from the
+    cache, and returns the number marked.
+    """
+    queryset = queryset.filter(deleted__isnull=True)
+    cache = get_cache()
+    if cache is not None:
+        invalidate_current_urls(cache, list(queryset.values_list("permalink", flat=True)))
+    deleted = timezone.now()
+    return queryset.update(deleted=deleted, updated=deleted)
+
+
+def _iter_permalink_items_history_links(content_type_id, object_id, permalink_items, store_current_url):
+    """Yields an unsaved history link for each of the given (permalink_name, permalink) items of an object."""
+    for permalink_name, permalink in permalink_items:
+        yield HistoryLink(
+            permalink=permalink,
+            permalink_hash=get_permalink_hash(permalink),
+            permalink_name=permalink_name,
+            object_id=object_id,
+            content_type_id=content_type_id,
+            current_url=permalink if store_current_url else "",
+        )
+
+
+# The backend of a history link context level that has not been resolved.
+_UNRESOLVED = object()
+
+
+class HistoryLinkContextLevel(object):
+
+    """
+    A level in a history link context.
+
+    The objects saved in the level are stored as a dict of (manager, content_type_id, pk) to
+    (model, obj, permalink_items), so repeated saves of the same row are coalesced. Only one
+    of obj and permalink_items is stored, and neither is stored for a deferred backend.
+
+    The deferred backend is resolved when the first object is saved, so starting and ending a
+    level that saves nothing does not read any settings.
+    """
+
+    __slots__ = ("_backend", "tasks", "is_invalid")
+
+    def __init__(self):
+        """Initializes the history link context level."""
+        self._backend = _UNRESOLVED
+        self.tasks = {}
+        self.is_invalid = False
+
+    def get_backend(self):
+        """Returns the deferred backend used by this level, or None."""
+        if self._backend is _UNRESOLVED:
+            self._backend = get_backend()
+        return self._backend
+
 
+class HistoryLinkContextManager(object):
 
-class HistoryLinkContextManager(local):
+    """
+    A context manager used to manage saving history link data.
 
-    """A thread-local context manager used to manage saving history link data."""
+    The stack of context levels is stored in a context variable, so each thread and asyncio
+    task has its own stack. The levels themselves are shared with any copies of the context,
+    such as sync_to_async() calls or functions wrapped with wrap().
+    """
 
     def __init__(self):
         """Initializes the history link context."""
-        self._stack = []
+        self._stack = ContextVar("historylinks_stack", default=())
         # Connect to the signalling framework.
         request_finished.connect(self._request_finished_receiver)
 
     def is_active(self):
         """Checks that this history link context is active."""
-        return bool(self._stack)
+        return bool(self._stack.get())
 
     def _assert_active(self):
         """Ensures that the history link is active."""
         if not self.is_active():
             raise HistoryLinkContextError("The history link context is not active.")
 
+    def _get_level(self):
+        """Returns the current level of the history link context."""
+        self._assert_active()
+        return self._stack.get()[-1]
+
     def start(self):
         """Starts a level in the history link context."""
-        self._stack.append((set(), False))
+        self._stack.set(self._stack.get() + (HistoryLinkContextLevel(),))
 
     def add_to_context(self, manager, obj):
-        """Adds an object to the current context, if active."""
-        self._assert_active()
-        objects, _ = self._stack[-1]
-        objects.add((manager, obj))
+        """
+        Adds an object to the current context, if active.
+
+        The permalinks of the object are generated immediately, and the object itself is not
+        kept, unless its adapter loads related objects in bulk.
+        """
+        level = self._get_level()
+        model = obj.__class__
+        key = (manager, ContentType.objects.get_for_model(model).id, obj.pk)
+        if level.get_backend() is not None:
+            # Only the primary key is needed to defer the update.
+            level.tasks[key] = (model, None, None)
+            return
+        adapter = manager.get_adapter(model)
+        if adapter.select_related or adapter.prefetch_related:
+            # Keep the object, so its related objects can be loaded in bulk.
+            level.tasks[key] = (model, obj, None)
+        else:
+            level.tasks[key] = (model, None, adapter.get_permalink_items(obj))
+
+    def has_pending(self):
+        """Checks whether the current level of the history link context has any objects to save."""
+        stack = self._stack.get()
+        return bool(stack and stack[-1].tasks)
 
     def invalidate(self):
         """Marks this history link context as broken, so should not be commited."""
-        self._assert_active()
-        objects, _ = self._stack[-1]
-        self._stack[-1] = (objects, True)
+        self._get_level().is_invalid = True
 
     def is_invalid(self):
         """Checks whether this history link context is invalid."""
-        self._assert_active()
-        _, is_invalid = self._stack[-1]
-        return is_invalid
+        return self._get_level().is_invalid
 
     def end(self):
         """Ends a level in the history link context."""
-        self._assert_active()
+        level = self._get_level()
+        self._stack.set(self._stack.get()[:-1])
         # Save all the models.
-        tasks, is_invalid = self._stack.pop()
-        if not is_invalid:
-            _bulk_save_history_links(list(chain.from_iterable(manager._update_obj_history_links_iter(obj) for manager, obj in tasks)))
+        tasks = level.tasks
+        if level.is_invalid or not tasks:
+            return
+        with measure(history_links_saved, self) as measurement:
+            link_count = 0
+            backend = level.get_backend()
+            if backend is None:
+                link_count = _bulk_save_history_links(self._iter_tasks_history_links(tasks))
+            else:
+                # Defer the updates until the saved objects have been committed.
+                pending = {}
+                for (manager, _, pk), (model, _, _) in tasks.items():
+                    pending.setdefault(manager, {}).setdefault(model, set()).add(pk)
+                transaction.on_commit(lambda: _enqueue_pending(backend, pending))
+            if measurement is not None:
+                measurement.kwargs.update(object_count=len(tasks), link_count=link_count)
+
+    def _iter_tasks_history_links(self, tasks):
+        """Yields one or more unsaved history links for each of the given tasks."""
+        store_current_url = get_setting("STORE_CURRENT_URL")
+        objs_by_manager = {}
+        for (manager, content_type_id, pk), (_, obj, permalink_items) in tasks.items():
+            if obj is None:
+                yield from _iter_permalink_items_history_links(
+                    content_type_id,
+                    force_str(pk),
+                    permalink_items,
+                    store_current_url,
+                )
+            else:
+                objs_by_manager.setdefault(manager, []).append(obj)
+        for manager, objs in objs_by_manager.items():
+            yield from manager._iter_objs_history_links(objs)
 
     # Context management.
 
@@ -134,6 +481,21 @@ class HistoryLinkContextManager(local):
         """
         return HistoryLinkContext(self)
 
+    def wrap(self, func):
+        """
+        Returns a function that calls func in a copy of the current context, so objects saved
+        by func are added to the current history link context, even in another thread.
+
+        Use this when submitting work to a thread pool. The work must complete before the
+        current level of the history link context ends.
+        """
+        context = copy_context()
+
+        @wraps(func)
+        def do_history_link_context(*args, **kwargs):
+            return context.copy().run(func, *args, **kwargs)
+        return do_history_link_context
+
     # Signalling hooks.
 
     def _request_finished_receiver(self, **kwargs):
@@ -146,6 +508,12 @@ class HistoryLinkContextManager(local):
             self.end()
 
 
+def _enqueue_pending(backend, pending):
+    """Enqueues the pending history link updates for each manager with the given backend."""
+    for manager, manager_pending in pending.items():
+        backend.enqueue(manager, manager_pending)
+
+
 class HistoryLinkContext(object):
 
     """An individual context for a history link update."""
@@ -184,7 +552,7 @@ class HistoryLinkContext(object):
         return do_history_link_context
 
 
-# The shared, thread-safe history link context manager.
+# The shared, thread-safe and async-safe history link context manager.
 history_link_context_manager = HistoryLinkContextManager()
 
 
@@ -223,6 +591,8 @@ class HistoryLinkManager(object):
         self._registered_models[model] = adapter_obj
         # Connect to the signalling framework.
         post_save.connect(self._post_save_receiver, model)
+        if get_setting("ON_DELETE") is not None:
+            post_delete.connect(self._post_delete_receiver, model)
         # Return the model, allowing this to be used as a class decorator.
         return model
 
@@ -242,6 +612,7 @@ class HistoryLinkManager(object):
         del self._registered_models[model]
         # Disconnect from the signalling framework.
         post_save.disconnect(self._post_save_receiver, model)
+        post_delete.disconnect(self._post_delete_receiver, model)
 
     def get_registered_models(self):
         """Returns a sequence of models that have been registered with this history link manager."""
@@ -255,49 +626,243 @@ class HistoryLinkManager(object):
             model=model,
         ))
 
-    def _update_obj_history_links_iter(self, obj):
-        """Either updates the given object's history links, or yields one or more unsaved history links."""
-        model = obj.__class__
-        adapter = self.get_adapter(model)
-        content_type = ContentType.objects.get_for_model(model)
-        object_id = force_str(obj.pk)
-        # Create the history link data.
-        for permalink_name, permalink_value in adapter.get_permalinks(obj).items():
-            history_link_data = {
-                "permalink": permalink_value,
-                "permalink_name": permalink_name,
-                "object_id": object_id,
-                "content_type": content_type,
-            }
-            update_count = HistoryLink.objects.filter(
-                permalink=permalink_value,
-            ).update(**history_link_data)
-            if update_count == 0:
-                yield HistoryLink(**history_link_data)
+    def _iter_objs_history_links(self, objs):
+        """Yields one or more unsaved history links for each of the given objs."""
+        objs_by_model = {}
+        for obj in objs:
+            objs_by_model.setdefault(obj.__class__, []).append(obj)
+        store_current_url = get_setting("STORE_CURRENT_URL")
+        for model, model_objs in objs_by_model.items():
+            adapter = self.get_adapter(model)
+            content_type_id = ContentType.objects.get_for_model(model).id
+            # Create the history link data.
+            for obj, permalink_items in adapter.get_permalinks_bulk(model_objs):
+                yield from _iter_permalink_items_history_links(
+                    content_type_id,
+                    force_str(obj.pk),
+                    permalink_items,
+                    store_current_url,
+                )
+
+    def _update_pks_history_links(self, model, pks):
+        """Updates the history links for the objects of the given model with the given primary keys."""
+        queryset = self.get_adapter(model).prepare_queryset(model._default_manager.all())
+        connection = connections[router.db_for_read(model)]
+        _bulk_save_history_links(chain.from_iterable(
+            self._iter_objs_history_links(queryset.filter(pk__in=batch))
+            for batch in _iter_batches(connection, ("pk",), list(pks))
+        ))
 
     def update_obj_history_links(self, obj):
         """Updates the history links for the given obj."""
-        _bulk_save_history_links(list(self._update_obj_history_links_iter(obj)))
+        self.update_objs_history_links((obj,))
+
+    def update_objs_history_links(self, objs):
+        """Updates the history links for the given objs, using a constant number of queries."""
+        with measure(history_links_saved, self) as measurement:
+            objs = list(objs)
+            link_count = _bulk_save_history_links(self._iter_objs_history_links(objs))
+            if measurement is not None:
+                measurement.kwargs.update(object_count=len(objs), link_count=link_count)
+
+    def update_history_links_for_queryset(self, queryset, batch_size=1000):
+        """
+        Updates the history links for the objects in the given queryset, in batches of
+        batch_size objects.
+
+        Returns the number of objects updated.
+        """
+        obj_count = 0
+        queryset = self.get_adapter(queryset.model).prepare_queryset(queryset)
+        for objs in _iter_object_batches(queryset, batch_size):
+            self.update_objs_history_links(objs)
+            obj_count += len(objs)
+        return obj_count
+
+    def _objs_saved(self, objs):
+        """Adds the given objs to the current history link context, or updates their history links."""
+        if self._history_link_context_manager.is_active():
+            for obj in objs:
+                self._history_link_context_manager.add_to_context(self, obj)
+        else:
+            self.update_objs_history_links(objs)
+
+    def _has_permalink_fields(self, model, fields):
+        """Checks whether any of the given fields are used to generate the permalinks of the given model."""
+        permalink_fields = self.get_adapter(model).permalink_fields
+        return permalink_fields is None or bool(set(permalink_fields).intersection(fields))
 
     # Signalling hooks.
 
-    def _post_save_receiver(self, instance, raw=False, **kwargs):
+    def _post_save_receiver(self, instance, raw=False, update_fields=None, **kwargs):
         """Signal handler for when a registered model has been saved."""
+        if update_fields is not None and not self._has_permalink_fields(instance.__class__, update_fields):
+            return
         if not raw:
             if self._history_link_context_manager.is_active():
                 self._history_link_context_manager.add_to_context(self, instance)
             else:
                 self.update_obj_history_links(instance)
 
+    def _post_delete_receiver(self, instance, **kwargs):
+        """Signal handler for when a registered model has been deleted."""
+        on_delete = get_setting("ON_DELETE")
+        if on_delete == "delete":
+            _delete_history_links(HistoryLink.objects.for_object(instance))
+        elif on_delete == "tombstone":
+            _tombstone_history_links(HistoryLink.objects.for_object(instance))
+
     # Accessing current URLs.
 
-    def get_current_url(self, path):
-        """Returns the current URL for whatever used to exist at the given path."""
-        # Get the history links.
+    def get_current_url(self, path, gone=None):
+        """
+        Returns the current URL for whatever used to exist at the given path.
+
+        If HISTORYLINKS_MAX_REDIRECT_DEPTH is greater than 1, chains of history links are
+        followed up to that many links, and None is returned if the chain loops back on itself.
+
+        If the object at the given path has been deleted, and its history link is a tombstone,
+        gone is returned.
+        """
+        with measure(current_url_resolved, self) as measurement:
+            current_url = self._resolve_current_url(path)
+            if current_url == GONE:
+                current_url = gone
+            if measurement is not None:
+                measurement.kwargs.update(path=path, current_url=current_url)
+        return current_url
+
+    def _resolve_current_url(self, path):
+        """Returns the current URL for the given path from the redirect map, cache or database."""
+        redirect_map = get_redirect_map()
+        if redirect_map is not None:
+            current_url = self._follow_redirect_map(redirect_map, path)
+            if current_url != UNRESOLVED:
+                return current_url
+        cache = get_cache()
+        if cache is None:
+            return self._get_current_url(path)
+        return get_cached_current_url(cache, path, self._get_current_url)
+
+    async def aget_current_url(self, path, gone=None):
+        """
+        Returns the current URL for whatever used to exist at the given path, without blocking
+        the event loop.
+
+        History links are looked up with the async ORM and cache API. Refreshing the redirect
+        map, following a chain of history links, or resolving a history link without a stored
+        current URL calls the adapter, so is run in a thread. Takes the same arguments as
+        get_current_url().
+        """
+        with measure(current_url_resolved, self) as measurement:
+            if hasattr(QuerySet, "aget"):
+                current_url = await self._aresolve_current_url(path)
+            else:
+                # The async ORM is not available before Django 4.1.
+                current_url = await sync_to_async(self._resolve_current_url)(path)
+            if current_url == GONE:
+                current_url = gone
+            if measurement is not None:
+                measurement.kwargs.update(path=path, current_url=current_url)
+        return current_url
+
+    async def _aresolve_current_url(self, path):
+        """Returns the current URL for the given path from the redirect map, cache or database."""
+        redirect_map = get_redirect_map()
+        if redirect_map is not None:
+            if redirect_map.is_stale():
+                await sync_to_async(redirect_map.get)(path)
+            current_url = self._follow_redirect_map(redirect_map, path, refresh=False)
+            if current_url != UNRESOLVED:
+                return current_url
+        cache = get_cache()
+        if cache is None:
+            return await self._aget_current_url(path)
+        return await aget_cached_current_url(cache, path, self._aget_current_url)
+
+    async def _aget_current_url(self, path):
+        """Returns the current URL for the given path from the database."""
         try:
-            history_link = HistoryLink.objects.get(permalink=path)
+            history_link = await HistoryLink.objects.for_permalink(path).aget()
         except HistoryLink.DoesNotExist:
             return None
+        if history_link.deleted is not None:
+            return GONE
+        max_depth = get_setting("MAX_REDIRECT_DEPTH")
+        # Use the stored current URL, if available, without leaving the event loop.
+        if max_depth <= 1 and history_link.current_url and get_setting("STORE_CURRENT_URL"):
+            return history_link.current_url
+        return (await sync_to_async(self._follow_history_link)(history_link, max_depth))[1]
+
+    def _follow_redirect_map(self, redirect_map, path, refresh=True):
+        """
+        Returns the current URL for the given path from the redirect map, or UNRESOLVED if it
+        must be resolved from the database.
+
+        If refresh is False, the redirect map is not refreshed, even if it is stale.
+        """
+        visited = {path}
+        current_url = redirect_map.get(path, refresh)
+        for _ in range(get_setting("MAX_REDIRECT_DEPTH") - 1):
+            if current_url is None or current_url == UNRESOLVED or current_url in visited:
+                break
+            next_url = redirect_map.get(current_url, refresh)
+            # The chain continues through a history link without a stored current URL.
+            if next_url == UNRESOLVED:
+                return UNRESOLVED
+            # Stop at a URL that is not a history link, or that is already current.
+            if next_url is None or next_url == current_url:
+                break
+            visited.add(current_url)
+            current_url = next_url
+        if len(visited) > 1 and current_url in visited:
+            return None
+        return current_url
+
+    def _get_current_url(self, path):
+        """Returns the current URL for the given path from the database."""
+        try:
+            history_link = HistoryLink.objects.for_permalink(path).get()
+        except HistoryLink.DoesNotExist:
+            return None
+        return self._follow_history_link(history_link, get_setting("MAX_REDIRECT_DEPTH"))[1]
+
+    def _follow_history_link(self, history_link, max_depth):
+        """
+        Follows the given history link to the end of its chain, up to max_depth links.
+
+        Returns a tuple of the last history link in the chain and its current URL, or
+        (None, None) if the chain loops back on itself.
+        """
+        visited = {history_link.permalink}
+        current_url = self._get_history_link_url(history_link)
+        for _ in range(max_depth - 1):
+            if current_url is None or current_url == GONE or current_url in visited:
+                break
+            try:
+                next_history_link = HistoryLink.objects.for_permalink(current_url).get()
+            except HistoryLink.DoesNotExist:
+                break
+            # Stop at a URL that is a current URL of the same object.
+            if (next_history_link.content_type_id, next_history_link.object_id) == (
+                history_link.content_type_id,
+                history_link.object_id,
+            ):
+                break
+            visited.add(current_url)
+            history_link = next_history_link
+            current_url = self._get_history_link_url(history_link)
+        if len(visited) > 1 and current_url in visited:
+            return None, None
+        return history_link, current_url
+
+    def _get_history_link_url(self, history_link):
+        """Returns the current URL of the object of the given history link."""
+        if history_link.deleted is not None:
+            return GONE
+        # Use the stored current URL, if available.
+        if history_link.current_url and get_setting("STORE_CURRENT_URL"):
+            return history_link.current_url
         # Resolve the model.
         model = ContentType.objects.get_for_id(id=history_link.content_type_id).model_class()
         # Resolve the adapter.
@@ -310,11 +875,172 @@ class HistoryLinkManager(object):
             obj = model._default_manager.get(pk=history_link.object_id)
         except model.DoesNotExist:
             return None
-        # Resolve the permalinks.
-        permalinks = adapter.get_permalinks(obj)
         # Resolve the specific permalink.
-        return permalinks.get(history_link.permalink_name, None)
+        for permalink_name, permalink in adapter.get_permalink_items(obj):
+            if permalink_name == history_link.permalink_name:
+                return permalink
+        return None
+
+    def _iter_history_links_current_urls(self, history_links):
+        """
+        Yields a tuple of (history_link, current_url) for each of the given history links,
+        loading their objects in bulk.
+
+        The current URL is None if the object no longer exists, or GONE if the history link
+        is a tombstone. Chains of history links are not followed.
+        """
+        store_current_url = get_setting("STORE_CURRENT_URL")
+        unresolved_history_links = {}
+        for history_link in history_links:
+            if history_link.deleted is not None:
+                yield history_link, GONE
+            elif history_link.current_url and store_current_url:
+                yield history_link, history_link.current_url
+            else:
+                unresolved_history_links.setdefault(history_link.content_type_id, []).append(history_link)
+        # Resolve the remaining history links through their adapters.
+        for content_type_id, content_type_history_links in unresolved_history_links.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            permalinks = {}
+            if model is not None and self.is_registered(model):
+                adapter = self.get_adapter(model)
+                connection = connections[router.db_for_read(model)]
+                object_ids = list({history_link.object_id for history_link in content_type_history_links})
+                for batch in _iter_batches(connection, ("pk",), object_ids):
+                    for obj, permalink_items in adapter.get_permalinks_bulk(
+                        adapter.prepare_queryset(model._default_manager.filter(pk__in=batch)),
+                    ):
+                        permalinks[force_str(obj.pk)] = dict(permalink_items)
+            for history_link in content_type_history_links:
+                yield history_link, permalinks.get(history_link.object_id, {}).get(history_link.permalink_name)
+
+    def collapse_history_links(self, history_links, max_depth):
+        """
+        Rewrites any of the given history links that lead to another object's history link, so
+        that they point directly at the object at the end of the chain, up to max_depth links.
+
+        Returns the number of history links rewritten.
+        """
+        store_current_url = get_setting("STORE_CURRENT_URL")
+        links_to_save = []
+        for history_link in history_links:
+            last_history_link, current_url = self._follow_history_link(history_link, max_depth)
+            # Only collapse chains that end at an existing object.
+            if current_url is None or current_url == GONE:
+                continue
+            if last_history_link is not None and last_history_link.pk != history_link.pk:
+                links_to_save.append(HistoryLink(
+                    permalink=history_link.permalink,
+                    permalink_hash=history_link.permalink_hash,
+                    permalink_name=last_history_link.permalink_name,
+                    content_type_id=last_history_link.content_type_id,
+                    object_id=last_history_link.object_id,
+                    current_url=current_url if store_current_url else "",
+                ))
+        _bulk_save_history_links(links_to_save)
+        return len(links_to_save)
 
 
 # The default history link manager.
 default_history_link_manager = HistoryLinkManager()
+
+
+def _get_unique_attnames(model):
+    """Returns a list of tuples of attnames, other than the primary key, that identify an object of the given model."""
+    opts = model._meta
+    unique_attnames = [(field.attname,) for field in opts.concrete_fields if field.unique and not field.primary_key]
+    unique_attnames.extend(
+        tuple(opts.get_field(field_name).attname for field_name in field_names)
+        for field_names in chain(
+            opts.unique_together,
+            (constraint.fields for constraint in opts.total_unique_constraints),
+        )
+    )
+    return unique_attnames
+
+
+class RegisteredModelQuerySetMixin(object):
+
+    """
+    A mixin for querysets of registered models, which updates history links after
+    bulk_create(), bulk_update() and update().
+    """
+
+    # The history link manager the model is registered with.
+    history_link_manager = default_history_link_manager
+
+    def _is_history_link_registered(self):
+        """Checks whether the model of this queryset is registered."""
+        return self.history_link_manager.is_registered(self.model)
+
+    def _get_created_objs(self, objs):
+        """
+        Loads the rows for the given created objs, which have no primary key, by a unique
+        field. Returns None if the model has no unique fields that are set on all the objs.
+        """
+        connection = connections[self.db]
+        for attnames in _get_unique_attnames(self.model):
+            values = [tuple(getattr(obj, attname) for attname in attnames) for obj in objs]
+            if any(None in obj_values for obj_values in values):
+                continue
+            created_objs = []
+            for batch in _iter_batches(connection, attnames, values):
+                if len(attnames) == 1:
+                    lookup = Q(**{attnames[0] + "__in": [obj_values[0] for obj_values in batch]})
+                else:
+                    lookup = reduce(or_, (Q(**dict(zip(attnames, obj_values))) for obj_values in batch))
+                created_objs.extend(self.model._base_manager.using(self.db).filter(lookup))
+            return created_objs
+        return None
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Creates the given objs, and updates their history links.
+
+        If the database does not return the primary keys of the created objs, or conflicts
+        are ignored, the objs are loaded again by a unique field.
+        """
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if self._is_history_link_registered():
+            saved_objs = [obj for obj in objs if obj.pk is not None]
+            unsaved_objs = [obj for obj in objs if obj.pk is None]
+            if unsaved_objs:
+                created_objs = self._get_created_objs(unsaved_objs)
+                if created_objs is None:
+                    logger.warning(
+                        "Could not update the history links for %d %s objects without a primary key, as the model "
+                        "has no unique fields to load them by",
+                        len(unsaved_objs),
+                        self.model._meta.label,
+                    )
+                else:
+                    saved_objs.extend(created_objs)
+            self.history_link_manager._objs_saved(saved_objs)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """Updates the given fields of the given objs, and updates their history links."""
+        objs = list(objs)
+        result = super().bulk_update(objs, fields, *args, **kwargs)
+        if self._is_history_link_registered() and self.history_link_manager._has_permalink_fields(self.model, fields):
+            self.history_link_manager._objs_saved(objs)
+        return result
+
+    def update(self, **kwargs):
+        """Updates the objects in this queryset, and updates their history links."""
+        if not self._is_history_link_registered() or not self.history_link_manager._has_permalink_fields(
+            self.model,
+            kwargs,
+        ):
+            return super().update(**kwargs)
+        # The queryset filters may not match after the update, so remember the updated objects.
+        pks = list(self.values_list("pk", flat=True))
+        result = super().update(**kwargs)
+        if not pks:
+            return result
+        queryset = self.history_link_manager.get_adapter(self.model).prepare_queryset(
+            self.model._default_manager.using(self.db),
+        )
+        for batch in _iter_batches(connections[self.db], ("pk",), pks):
+            self.history_link_manager._objs_saved(queryset.filter(pk__in=batch))
+        return result
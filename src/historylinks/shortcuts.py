@@ -1,8 +1,14 @@
-from historylinks.registration import HistoryLinkAdapter, history_link_context_manager, default_history_link_manager
+from historylinks.registration import (
+    HistoryLinkAdapter,
+    RegisteredModelQuerySetMixin,
+    history_link_context_manager,
+    default_history_link_manager,
+)
 
 
 # URL resolution.
 get_current_url = default_history_link_manager.get_current_url
+aget_current_url = default_history_link_manager.aget_current_url
 
 
 # Easy registration.
@@ -13,5 +19,10 @@ get_registered_models = default_history_link_manager.get_registered_models
 get_adapter = default_history_link_manager.get_adapter
 
 
+# Bulk updates.
+update_history_links_for_queryset = default_history_link_manager.update_history_links_for_queryset
+
+
 # Easy context management.
 update_history_links = history_link_context_manager.update_history_links
+wrap = history_link_context_manager.wrap
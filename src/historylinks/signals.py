@@ -0,0 +1,69 @@
+"""
+Signals sent by django-historylinks, for instrumenting history link operations.
+
+Each signal is sent with the number of database queries issued and the elapsed time in
+seconds, as query_count and duration. The queries are only counted, and the signal only
+sent, if the signal has any receivers.
+"""
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+from django.dispatch import Signal
+
+
+# Sent when the history links of a history link context, or of one or more objects, are
+# saved. The sender is the HistoryLinkManager or HistoryLinkContextManager. Also sent with
+# object_count and link_count, the number of history links written. When a deferred
+# backend is used, the history links of a context are not written, and link_count is 0.
+history_links_saved = Signal()
+
+# Sent when HistoryLinkManager.get_current_url() is called. The sender is the
+# HistoryLinkManager. Also sent with path and current_url.
+current_url_resolved = Signal()
+
+# Sent when HistoryLinkFallbackMiddleware attempts to rescue a 404 response. The sender is
+# the middleware class. Also sent with request, path, redirect_url, which is None if the
+# response could not be redirected, and gone, which is True if a 410 response was returned.
+response_rescued = Signal()
+
+
+class _Measurement(object):
+
+    """The queries issued and time elapsed while measuring an operation."""
+
+    def __init__(self):
+        self.query_count = 0
+        self.duration = 0.0
+        self.kwargs = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        """Counts a query, when used as a database execute wrapper."""
+        self.query_count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def measure(signal, sender):
+    """
+    Measures the operation in the block, and sends the given signal once it completes.
+
+    Yields an object whose kwargs are sent with the signal, or None if the signal has no
+    receivers. Nothing is sent if the block raises an exception.
+    """
+    if not signal.has_listeners(sender):
+        yield None
+        return
+    measurement = _Measurement()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(measurement))
+        start = time.perf_counter()
+        yield measurement
+        measurement.duration = time.perf_counter() - start
+    signal.send(
+        sender=sender,
+        query_count=measurement.query_count,
+        duration=measurement.duration,
+        **measurement.kwargs
+    )
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+Benchmarks the hot paths of django-historylinks against a synthetic dataset.
+
+Each benchmark is run twice: once to measure the wall time and number of queries, and
+once under tracemalloc to measure the peak memory. The results are written as JSON, so
+they can be compared between commits.
+
+Usage:
+
+    python src/tests/benchmark.py --links 10000 --output benchmark.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class QueryCounter(object):
+
+    """A database execute wrapper that counts queries."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Benchmark(object):
+
+    """A benchmark of a single hot path."""
+
+    def __init__(self, name, setup, run):
+        self.name = name
+        self.setup = setup
+        self.run = run
+
+    def measure(self, connection):
+        """Runs the benchmark, returning a dict of results."""
+        # Measure the wall time and the number of queries.
+        operation_count = self.setup()
+        query_counter = QueryCounter()
+        with connection.execute_wrapper(query_counter):
+            start = time.perf_counter()
+            self.run()
+            wall_time = time.perf_counter() - start
+        # Measure the peak memory.
+        self.setup()
+        tracemalloc.start()
+        try:
+            self.run()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {
+            "operations": operation_count,
+            "queries": query_counter.count,
+            "queries_per_operation": query_counter.count / operation_count,
+            "wall_time": wall_time,
+            "wall_time_per_operation": wall_time / operation_count,
+            "peak_memory": peak_memory,
+        }
+
+
+class BenchmarkSuite(object):
+
+    """
+    The benchmarks for a synthetic dataset.
+
+    The dataset contains one registered object for every two history links. Each object
+    has a current history link, and a stale history link that redirects to it.
+    """
+
+    def __init__(self, link_count, sample_size, batch_size, seed):
+        self.object_count = max(link_count // 2, 1)
+        self.sample_size = min(sample_size, self.object_count)
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self._rename_count = 0
+
+    def create_dataset(self):
+        from django.contrib.contenttypes.models import ContentType
+        from historylinks.conf import get_setting
+        from historylinks.models import get_permalink_hash, HistoryLink
+        from test_historylinks.models import HistoryLinkTestModel
+        store_current_url = get_setting("STORE_CURRENT_URL")
+        content_type = ContentType.objects.get_for_model(HistoryLinkTestModel)
+        for batch_start in range(0, self.object_count, self.batch_size):
+            batch_range = range(batch_start, min(batch_start + self.batch_size, self.object_count))
+            objs = HistoryLinkTestModel.objects.bulk_create(
+                HistoryLinkTestModel(slug="obj-{index}".format(index=index))
+                for index in batch_range
+            )
+            stale_links = []
+            for index, obj in zip(batch_range, objs):
+                permalink = "/old-{index}/".format(index=index)
+                stale_links.append(HistoryLink(
+                    permalink=permalink,
+                    permalink_hash=get_permalink_hash(permalink),
+                    permalink_name="get_absolute_url",
+                    content_type=content_type,
+                    object_id=str(obj.pk),
+                    current_url=obj.get_absolute_url() if store_current_url else "",
+                ))
+            HistoryLink.objects.bulk_create(stale_links)
+        # Build the current history links.
+        self.setup_build()
+        self.run_build()
+
+    def _get_sample_objs(self):
+        from test_historylinks.models import HistoryLinkTestModel
+        pks = self.random.sample(
+            list(HistoryLinkTestModel.objects.order_by("pk").values_list("pk", flat=True)[:self.object_count]),
+            self.sample_size,
+        )
+        return list(HistoryLinkTestModel.objects.filter(pk__in=pks))
+
+    def _rename_objs(self, objs):
+        self._rename_count += 1
+        for obj in objs:
+            obj.slug = "{slug}-r{rename_count}".format(
+                slug=obj.slug.split("-r")[0],
+                rename_count=self._rename_count,
+            )
+            obj.save()
+
+    # buildhistorylinks.
+
+    def setup_build(self):
+        from historylinks.models import HistoryLink
+        HistoryLink.objects.exclude(permalink__startswith="/old-").delete()
+        return self.object_count
+
+    def run_build(self):
+        from django.core.management import call_command
+        call_command("buildhistorylinks", batch_size=self.batch_size, verbosity=0)
+
+    # _post_save_receiver.
+
+    def setup_post_save(self):
+        self._objs = self._get_sample_objs()
+        return len(self._objs)
+
+    def run_post_save(self):
+        self._rename_objs(self._objs)
+
+    # HistoryLinkContextManager.end().
+
+    def setup_context_end(self):
+        from historylinks.registration import history_link_context_manager
+        objs = self._get_sample_objs()
+        history_link_context_manager.start()
+        self._rename_objs(objs)
+        return len(objs)
+
+    def run_context_end(self):
+        from historylinks.registration import history_link_context_manager
+        history_link_context_manager.end()
+
+    # get_current_url.
+
+    def setup_get_current_url(self):
+        self._paths = [
+            "/old-{index}/".format(index=index)
+            for index in self.random.sample(range(self.object_count), self.sample_size)
+        ]
+        return len(self._paths)
+
+    def setup_get_current_url_missing(self):
+        self._paths = [
+            "/missing-{index}/".format(index=index)
+            for index in self.random.sample(range(self.object_count), self.sample_size)
+        ]
+        return len(self._paths)
+
+    def run_get_current_url(self):
+        from historylinks.registration import default_history_link_manager
+        for path in self._paths:
+            default_history_link_manager.get_current_url(path)
+
+    def get_benchmarks(self):
+        return [
+            Benchmark("buildhistorylinks", self.setup_build, self.run_build),
+            Benchmark("post_save", self.setup_post_save, self.run_post_save),
+            Benchmark("context_end", self.setup_context_end, self.run_context_end),
+            Benchmark("get_current_url", self.setup_get_current_url, self.run_get_current_url),
+            Benchmark("get_current_url_missing", self.setup_get_current_url_missing, self.run_get_current_url),
+        ]
+
+
+def _get_git_commit():
+    """Returns the current git commit, if available."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=BASE_DIR,
+            stderr=subprocess.DEVNULL,
+        ).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def _test_database(database_name):
+    """Creates a test database for the benchmark, destroying it afterwards."""
+    from django.db import connection
+    old_name = connection.settings_dict["NAME"]
+    if database_name:
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = database_name
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths of django-historylinks.")
+    parser.add_argument(
+        "--links",
+        type=int,
+        default=10000,
+        help="The number of history links in the synthetic dataset.",
+    )
+    parser.add_argument(
+        "--sample-size",
+        type=int,
+        default=1000,
+        help="The number of objects to save, and URLs to resolve, in each benchmark.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="The batch size used to create the dataset and run buildhistorylinks.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The random seed used to choose the sampled objects and URLs.",
+    )
+    parser.add_argument(
+        "--database",
+        default=None,
+        help="The SQLite database file to benchmark against, which is destroyed afterwards. By default, an in-memory database is used.",
+    )
+    parser.add_argument(
+        "--store-current-url",
+        action="store_true",
+        default=False,
+        help="Benchmark with HISTORYLINKS_STORE_CURRENT_URL enabled.",
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        default=None,
+        help="Only run the named benchmark. Can be given more than once.",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Write the results to this file. By default, the results are written to stdout.",
+    )
+    options = parser.parse_args(argv)
+    # Configure Django.
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+    import django
+    from django.conf import settings
+    from django.test.utils import override_settings
+    django.setup()
+    from historylinks.registration import default_history_link_manager
+    from test_historylinks.models import HistoryLinkTestModel
+    # Run the benchmarks.
+    suite = BenchmarkSuite(options.links, options.sample_size, options.batch_size, options.seed)
+    results = {}
+    with override_settings(DEBUG=False, HISTORYLINKS_STORE_CURRENT_URL=options.store_current_url):
+        with _test_database(options.database) as connection:
+            default_history_link_manager.register(HistoryLinkTestModel)
+            try:
+                suite.create_dataset()
+                for benchmark in suite.get_benchmarks():
+                    if options.only and benchmark.name not in options.only:
+                        continue
+                    results[benchmark.name] = benchmark.measure(connection)
+            finally:
+                default_history_link_manager.unregister(HistoryLinkTestModel)
+        store_current_url = settings.HISTORYLINKS_STORE_CURRENT_URL
+    # Write the results.
+    output = json.dumps({
+        "commit": _get_git_commit(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "links": suite.object_count * 2,
+        "sample_size": suite.sample_size,
+        "batch_size": suite.batch_size,
+        "seed": options.seed,
+        "settings": {
+            "HISTORYLINKS_STORE_CURRENT_URL": store_current_url,
+        },
+        "results": results,
+    }, indent=4, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as handle:
+            handle.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
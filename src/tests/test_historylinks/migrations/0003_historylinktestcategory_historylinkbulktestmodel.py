@@ -0,0 +1,27 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_historylinks', '0002_historylinktestmodel_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryLinkTestCategory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HistoryLinkBulkTestModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='test_historylinks.historylinktestcategory')),
+            ],
+        ),
+    ]
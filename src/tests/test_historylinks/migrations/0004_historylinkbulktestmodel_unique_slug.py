@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_historylinks', '0003_historylinktestcategory_historylinkbulktestmodel'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='historylinkbulktestmodel',
+            constraint=models.UniqueConstraint(fields=('category', 'slug'), name='historylinkbulktestmodel_unique_slug'),
+        ),
+    ]
@@ -2,6 +2,8 @@ from __future__ import unicode_literals
 
 from django.db import models
 
+from historylinks.registration import RegisteredModelQuerySetMixin
+
 
 class HistoryLinkTestModel(models.Model):
 
@@ -9,5 +11,45 @@ class HistoryLinkTestModel(models.Model):
         unique=True,
     )
 
+    modified = models.DateTimeField(
+        auto_now=True,
+    )
+
     def get_absolute_url(self):
         return "/{slug}/".format(slug=self.slug)
+
+    @staticmethod
+    def get_index_url():
+        return "/"
+
+
+class HistoryLinkTestCategory(models.Model):
+
+    slug = models.SlugField(
+        unique=True,
+    )
+
+
+class HistoryLinkBulkTestQuerySet(RegisteredModelQuerySetMixin, models.QuerySet):
+
+    pass
+
+
+class HistoryLinkBulkTestModel(models.Model):
+
+    category = models.ForeignKey(
+        HistoryLinkTestCategory,
+        on_delete=models.CASCADE,
+    )
+
+    slug = models.SlugField()
+
+    objects = HistoryLinkBulkTestQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=("category", "slug"), name="historylinkbulktestmodel_unique_slug"),
+        ]
+
+    def get_absolute_url(self):
+        return "/{category}/{slug}/".format(category=self.category.slug, slug=self.slug)
@@ -1,14 +1,36 @@
+import asyncio
+import json
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
 from io import StringIO
+from unittest import mock
 
+from asgiref.sync import sync_to_async
 from django.contrib.contenttypes.models import ContentType
-from django.core.management import call_command
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
 from historylinks import shortcuts as historylinks
-from historylinks.models import HistoryLink
-from historylinks.registration import RegistrationError
-from test_historylinks.models import HistoryLinkTestModel
+from historylinks.management.commands import buildhistorylinks
+from historylinks.backends import ThreadPoolBackend
+from historylinks.models import get_permalink_hash, HistoryLink, HistoryLinkBuildCheckpoint, HistoryLinkQueueItem
+from historylinks.redirect_map import UNRESOLVED, RedirectMap, get_redirect_map
+from historylinks.registration import (
+    HistoryLinkAdapterError,
+    RegistrationError,
+    default_history_link_manager,
+    history_link_context_manager,
+)
+from historylinks.signals import current_url_resolved, history_links_saved, response_rescued
+from test_historylinks.models import HistoryLinkBulkTestModel, HistoryLinkTestCategory, HistoryLinkTestModel
 
 
 class RegistrationTest(TestCase):
@@ -27,6 +49,56 @@ class RegistrationTest(TestCase):
         self.assertTrue(HistoryLinkTestModel not in historylinks.get_registered_models())
         self.assertRaises(RegistrationError, lambda: isinstance(historylinks.get_adapter(HistoryLinkTestModel)))
 
+    def testRegistrationInvalidPermalinkMethod(self):
+        self.assertRaises(
+            HistoryLinkAdapterError,
+            lambda: historylinks.register(HistoryLinkTestModel, permalink_methods=("get_missing_url",)),
+        )
+        self.assertRaises(
+            HistoryLinkAdapterError,
+            lambda: historylinks.register(HistoryLinkTestModel, permalink_methods=("slug",)),
+        )
+        self.assertFalse(historylinks.is_registered(HistoryLinkTestModel))
+
+    def testGetPermalinks(self):
+        historylinks.register(HistoryLinkTestModel)
+        try:
+            adapter = historylinks.get_adapter(HistoryLinkTestModel)
+            obj = HistoryLinkTestModel(slug="foo")
+            self.assertEqual(adapter.get_permalink_items(obj), (("get_absolute_url", "/foo/"),))
+            self.assertEqual(adapter.get_permalinks(obj), {"get_absolute_url": "/foo/"})
+        finally:
+            historylinks.unregister(HistoryLinkTestModel)
+
+    def testGetPermalinksOverride(self):
+
+        class ExtendedAdapter(historylinks.HistoryLinkAdapter):
+
+            def get_permalinks(self, obj):
+                permalinks = super().get_permalinks(obj)
+                permalinks["get_index_url"] = "/index/"
+                return permalinks
+
+        historylinks.register(HistoryLinkTestModel, ExtendedAdapter)
+        try:
+            obj = HistoryLinkTestModel.objects.create(slug="foo")
+            self.assertEqual(
+                historylinks.get_adapter(HistoryLinkTestModel).get_permalink_items(obj),
+                (("get_absolute_url", "/foo/"), ("get_index_url", "/index/")),
+            )
+            self.assertEqual(historylinks.get_current_url("/index/"), "/index/")
+        finally:
+            historylinks.unregister(HistoryLinkTestModel)
+
+    def testGetPermalinksStaticMethod(self):
+        historylinks.register(HistoryLinkTestModel, permalink_methods=("get_absolute_url", "get_index_url"))
+        try:
+            adapter = historylinks.get_adapter(HistoryLinkTestModel)
+            obj = HistoryLinkTestModel(slug="foo")
+            self.assertEqual(adapter.get_permalinks(obj), {"get_absolute_url": "/foo/", "get_index_url": "/"})
+        finally:
+            historylinks.unregister(HistoryLinkTestModel)
+
 
 class HistoryLinkRedirectTest(TestCase):
 
@@ -36,6 +108,22 @@ class HistoryLinkRedirectTest(TestCase):
         self.obj.slug = "bar"
         self.obj.save()
 
+    def testLongURL(self):
+        permalink = "/{slug}/".format(slug="x" * 300)
+        HistoryLink.objects.create(
+            permalink=permalink,
+            permalink_name="get_absolute_url",
+            content_type=ContentType.objects.get_for_model(HistoryLinkTestModel),
+            object_id=str(self.obj.pk),
+        )
+        response = self.client.get(permalink)
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response["Location"], "/bar/")
+
+    def testPermalinkHashCollision(self):
+        HistoryLink.objects.filter(permalink="/foo/").update(permalink_hash=get_permalink_hash("/baz/"))
+        self.assertEqual(historylinks.get_current_url("/baz/"), None)
+
     def testRaisesException(self):
         # Ensure coverage of handle_exception in the middleware.
         with self.assertRaises(AssertionError) as e:
@@ -51,6 +139,642 @@ class HistoryLinkRedirectTest(TestCase):
         response = self.client.get("/baz/")
         self.assertEqual(response.status_code, 404)
 
+    async def testRedirectsToNewURLAsync(self):
+        response = await self.async_client.get("/foo/")
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response["Location"], "/bar/")
+        response = await self.async_client.get("/baz/")
+        self.assertEqual(response.status_code, 404)
+
+    async def testAsyncGetCurrentURL(self):
+        self.assertEqual(await historylinks.aget_current_url("/foo/"), "/bar/")
+        self.assertEqual(await historylinks.aget_current_url("/bar/"), "/bar/")
+        self.assertEqual(await historylinks.aget_current_url("/baz/"), None)
+
+    def testRedirectNeverCached(self):
+        response = self.client.get("/foo/")
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertFalse(response.has_header("ETag"))
+
+    @override_settings(
+        HISTORYLINKS_REDIRECT_STATUS=308,
+        HISTORYLINKS_REDIRECT_CACHE_TIMEOUT=60,
+        HISTORYLINKS_REDIRECT_SHARED_CACHE_TIMEOUT=3600,
+        HISTORYLINKS_REDIRECT_CACHE_PUBLIC=True,
+    )
+    def testRedirectCached(self):
+        response = self.client.get("/foo/")
+        self.assertEqual(response.status_code, 308)
+        self.assertEqual(response["Location"], "/bar/")
+        self.assertEqual(
+            set(response["Cache-Control"].split(", ")),
+            {"max-age=60", "s-maxage=3600", "public"},
+        )
+        # The ETag is stable until the redirect changes.
+        etag = response["ETag"]
+        self.assertEqual(self.client.get("/foo/")["ETag"], etag)
+        self.obj.slug = "baz"
+        self.obj.save()
+        if get_redirect_map() is not None:
+            get_redirect_map().refresh()
+        self.assertNotEqual(self.client.get("/foo/")["ETag"], etag)
+
+    @override_settings(
+        HISTORYLINKS_RESCUE_INCLUDE_PREFIXES=("/f", "/static/"),
+        HISTORYLINKS_RESCUE_INCLUDE_PATTERNS=(r"/b[a-z]+/$",),
+        HISTORYLINKS_RESCUE_EXCLUDE_PREFIXES=("/static/",),
+        HISTORYLINKS_RESCUE_EXCLUDE_PATTERNS=(r".*\.png$",),
+    )
+    def testRescuePathFilters(self):
+        self.assertEqual(self.client.get("/foo/").status_code, 301)
+        # Ineligible paths are not looked up.
+        for path in ("/static/foo/", "/foo.png", "/qux/"):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(path).status_code, 404)
+        # Paths matching an include pattern are looked up.
+        HistoryLink.objects.filter(permalink="/foo/").update(
+            permalink="/baz/",
+            permalink_hash=get_permalink_hash("/baz/"),
+        )
+        if get_redirect_map() is not None:
+            get_redirect_map().refresh()
+        self.assertEqual(self.client.get("/baz/").status_code, 301)
+
+    @override_settings(HISTORYLINKS_RESCUE_EXCLUDE_PREFIXES=("/foo/",))
+    async def testRescuePathFiltersAsync(self):
+        response = await self.async_client.get("/foo/")
+        self.assertEqual(response.status_code, 404)
+
+    def deleteWithTombstone(self):
+        with self.settings(HISTORYLINKS_ON_DELETE="tombstone"):
+            historylinks.unregister(HistoryLinkTestModel)
+            historylinks.register(HistoryLinkTestModel)
+            self.obj.delete()
+        if get_redirect_map() is not None:
+            get_redirect_map().refresh()
+
+    def testGone(self):
+        self.deleteWithTombstone()
+        # Tombstones are resolved with a single lookup.
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(historylinks.get_current_url("/foo/"), None)
+            self.assertEqual(historylinks.get_current_url("/bar/", gone="gone"), "gone")
+        self.assertLessEqual(len(queries), 2)
+        for path in ("/foo/", "/bar/"):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 410)
+            self.assertIn("no-cache", response["Cache-Control"])
+        with self.settings(HISTORYLINKS_GONE_CACHE_TIMEOUT=3600):
+            response = self.client.get("/foo/")
+            self.assertEqual(response.status_code, 410)
+            self.assertEqual(response["Cache-Control"], "max-age=3600")
+
+    async def testGoneAsync(self):
+        await sync_to_async(self.deleteWithTombstone)()
+        self.assertEqual(await historylinks.aget_current_url("/foo/", gone="gone"), "gone")
+        response = await self.async_client.get("/foo/")
+        self.assertEqual(response.status_code, 410)
+
+    def testSaveClearsTombstone(self):
+        self.deleteWithTombstone()
+        obj = HistoryLinkTestModel.objects.create(slug="foo")
+        if get_redirect_map() is not None:
+            get_redirect_map().refresh()
+        self.assertEqual(historylinks.get_current_url("/foo/"), "/foo/")
+        self.assertEqual(HistoryLink.objects.for_permalink("/foo/").get().deleted, None)
+        self.assertEqual(HistoryLink.objects.for_permalink("/foo/").get().object, obj)
+        self.assertEqual(self.client.get("/bar/").status_code, 410)
+
+    def tearDown(self):
+        historylinks.unregister(HistoryLinkTestModel)
+
+
+@override_settings(HISTORYLINKS_STORE_CURRENT_URL=True)
+class HistoryLinkStoreCurrentURLTest(HistoryLinkRedirectTest):
+
+    def testStoresCurrentURL(self):
+        self.obj.slug = "baz"
+        self.obj.save()
+        self.assertEqual(
+            set(HistoryLink.objects.values_list("permalink", "current_url")),
+            {("/foo/", "/baz/"), ("/bar/", "/baz/"), ("/baz/", "/baz/")},
+        )
+        # Resolving a URL does not load the object.
+        with self.assertNumQueries(1):
+            self.assertEqual(historylinks.get_current_url("/foo/"), "/baz/")
+
+
+@override_settings(HISTORYLINKS_CACHE="default")
+class HistoryLinkCacheTest(HistoryLinkRedirectTest):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def testCachesCurrentURL(self):
+        self.assertEqual(historylinks.get_current_url("/foo/"), "/bar/")
+        with self.assertNumQueries(0):
+            self.assertEqual(historylinks.get_current_url("/foo/"), "/bar/")
+        # Changing the object evicts its old history links.
+        self.obj.slug = "baz"
+        self.obj.save()
+        self.assertEqual(historylinks.get_current_url("/foo/"), "/baz/")
+
+    def testRenameBackEvictsCurrentURL(self):
+        self.assertEqual(historylinks.get_current_url("/bar/"), "/bar/")
+        # Moving back to an unchanged history link still evicts the object's history links.
+        self.obj.slug = "foo"
+        self.obj.save()
+        self.assertEqual(historylinks.get_current_url("/bar/"), "/foo/")
+        self.assertEqual(self.client.get("/bar/")["Location"], "/foo/")
+
+    def testCachesMissingURL(self):
+        self.assertEqual(historylinks.get_current_url("/missing/"), None)
+        with self.assertNumQueries(0):
+            self.assertEqual(historylinks.get_current_url("/missing/"), None)
+        # Creating a history link evicts the missing URL.
+        HistoryLinkTestModel.objects.create(slug="missing")
+        self.assertEqual(historylinks.get_current_url("/missing/"), "/missing/")
+
+
+class HistoryLinkReverseLookupTest(TestCase):
+
+    def setUp(self):
+        historylinks.register(HistoryLinkTestModel)
+        self.objs = [HistoryLinkTestModel.objects.create(slug="foo-{n}".format(n=n)) for n in range(3)]
+        for obj in self.objs:
+            obj.slug = "bar-" + obj.slug
+            obj.save()
+
+    def assertPermalinks(self, history_links, objs):
+        self.assertEqual(
+            set(history_links.values_list("permalink", flat=True)),
+            {permalink for obj in objs for permalink in (obj.get_absolute_url(), "/" + obj.slug[4:] + "/")},
+        )
+
+    def testForObject(self):
+        self.assertPermalinks(HistoryLink.objects.for_object(self.objs[0]), self.objs[:1])
+
+    def testForObjects(self):
+        with self.assertNumQueries(1):
+            self.assertPermalinks(HistoryLink.objects.for_objects(self.objs[:2]), self.objs[:2])
+        self.assertPermalinks(HistoryLink.objects.for_objects([]), [])
+
+    def testForObjectsQuerySet(self):
+        with self.assertNumQueries(1):
+            self.assertPermalinks(
+                HistoryLink.objects.for_objects(HistoryLinkTestModel.objects.filter(pk__in=[self.objs[1].pk])),
+                self.objs[1:2],
+            )
+
+    def tearDown(self):
+        historylinks.unregister(HistoryLinkTestModel)
+
+
+@override_settings(HISTORYLINKS_STORE_CURRENT_URL=True, HISTORYLINKS_REDIRECT_MAP=True)
+class HistoryLinkRedirectMapTest(HistoryLinkRedirectTest):
+
+    def setUp(self):
+        super().setUp()
+        get_redirect_map().reload()
+
+    def testRedirectMap(self):
+        self.assertEqual(historylinks.get_current_url("/foo/"), "/bar/")
+        with self.assertNumQueries(0):
+            self.assertEqual(historylinks.get_current_url("/foo/"), "/bar/")
+        # Changes are picked up by the next refresh.
+        self.obj.slug = "baz"
+        self.obj.save()
+        self.assertEqual(historylinks.get_current_url("/foo/"), "/bar/")
+        get_redirect_map().refresh()
+        with self.assertNumQueries(0):
+            self.assertEqual(historylinks.get_current_url("/foo/"), "/baz/")
+            self.assertEqual(historylinks.get_current_url("/bar/"), "/baz/")
+
+    def testRedirectMapMisses(self):
+        self.assertEqual(historylinks.get_current_url("/foo/"), "/bar/")
+        # Paths that are not history links are not looked up.
+        with self.assertNumQueries(0):
+            for _ in range(5):
+                self.assertEqual(historylinks.get_current_url("/wp-login.php"), None)
+
+    def testRedirectMapUnresolved(self):
+        HistoryLink.objects.filter(permalink="/foo/").update(current_url="")
+        self.assertEqual(get_redirect_map().get("/foo/"), UNRESOLVED)
+        # History links without a stored current URL are resolved from the database.
+        self.assertEqual(historylinks.get_current_url("/foo/"), "/bar/")
+
+    def testRedirectMapReload(self):
+        redirect_map = RedirectMap(60, 3600)
+        reloaded_redirect_map = RedirectMap(60, 0)
+        for current_redirect_map in (redirect_map, reloaded_redirect_map):
+            self.assertEqual(current_redirect_map.get("/foo/"), "/bar/")
+        # History links deleted elsewhere are only removed when the map is reloaded.
+        HistoryLink.objects.filter(permalink="/foo/").delete()
+        for current_redirect_map in (redirect_map, reloaded_redirect_map):
+            current_redirect_map.refresh()
+        self.assertEqual(redirect_map.get("/foo/"), "/bar/")
+        self.assertEqual(reloaded_redirect_map.get("/foo/"), None)
+
+    def testRedirectMapRemovesDeletedLinks(self):
+        self.assertEqual(historylinks.get_current_url("/foo/"), "/bar/")
+        with self.settings(HISTORYLINKS_ON_DELETE="delete"):
+            historylinks.unregister(HistoryLinkTestModel)
+            historylinks.register(HistoryLinkTestModel)
+            self.obj.delete()
+        get_redirect_map().refresh()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_redirect_map().get("/foo/", refresh=False), None)
+        self.assertEqual(historylinks.get_current_url("/foo/"), None)
+
+
+@override_settings(HISTORYLINKS_MAX_REDIRECT_DEPTH=5)
+class HistoryLinkChainTest(TestCase):
+
+    def setUp(self):
+        historylinks.register(HistoryLinkTestModel)
+        self.obj_x = HistoryLinkTestModel.objects.create(slug="x")
+        self.obj_y = HistoryLinkTestModel.objects.create(slug="y")
+        self.obj_x.slug = "old"
+        self.obj_x.save()
+        self.obj_x.slug = "x"
+        self.obj_x.save()
+        # The current URL of x now leads to y.
+        self.retarget("/x/", self.obj_y)
+
+    def retarget(self, permalink, obj):
+        HistoryLink.objects.filter(permalink=permalink).update(object_id=str(obj.pk))
+
+    def testFollowsChain(self):
+        self.assertEqual(historylinks.get_current_url("/old/"), "/y/")
+        self.assertEqual(historylinks.get_current_url("/y/"), "/y/")
+        with self.settings(HISTORYLINKS_MAX_REDIRECT_DEPTH=1):
+            self.assertEqual(historylinks.get_current_url("/old/"), "/x/")
+
+    def testDetectsCycle(self):
+        self.retarget("/y/", self.obj_x)
+        self.assertEqual(historylinks.get_current_url("/old/"), None)
+
+    def testCollapseHistoryLinks(self):
+        stdout = StringIO()
+        call_command("collapsehistorylinks", stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "Collapsed 1 history links.\n")
+        self.assertEqual(HistoryLink.objects.get(permalink="/old/").object, self.obj_y)
+        with self.settings(HISTORYLINKS_MAX_REDIRECT_DEPTH=1):
+            self.assertEqual(historylinks.get_current_url("/old/"), "/y/")
+
+    @override_settings(HISTORYLINKS_CACHE="default")
+    def testCollapseEvictsCachedChain(self):
+        cache.clear()
+        self.assertEqual(historylinks.get_current_url("/old/"), "/y/")
+        # A collapsed chain is evicted when the object at its end changes.
+        call_command("collapsehistorylinks", stdout=StringIO())
+        self.obj_y.slug = "z"
+        self.obj_y.save()
+        self.assertEqual(historylinks.get_current_url("/old/"), "/z/")
+
+    def testCollapseSkipsMissingObject(self):
+        HistoryLinkTestModel.objects.filter(pk=self.obj_y.pk).delete()
+        stdout = StringIO()
+        call_command("collapsehistorylinks", stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "Collapsed 0 history links.\n")
+        self.assertEqual(HistoryLink.objects.get(permalink="/old/").object, self.obj_x)
+
+    @override_settings(HISTORYLINKS_STORE_CURRENT_URL=True)
+    def testCollapseSkipsMissingObjectStoreCurrentURL(self):
+        self.testCollapseSkipsMissingObject()
+
+    def tearDown(self):
+        historylinks.unregister(HistoryLinkTestModel)
+
+
+class HistoryLinkBulkSaveTest(TestCase):
+
+    def setUp(self):
+        historylinks.register(HistoryLinkTestModel)
+
+    def saveAll(self, slug_prefix=""):
+        with CaptureQueriesContext(connection) as queries:
+            with historylinks.update_history_links():
+                for obj in HistoryLinkTestModel.objects.all():
+                    obj.slug = slug_prefix + obj.slug
+                    obj.save()
+        return [query for query in queries if '"historylinks_historylink"' in query["sql"]]
+
+    def assertBulkSave(self, max_queries):
+        with historylinks.update_history_links():
+            for n in range(10):
+                HistoryLinkTestModel.objects.create(slug="foo-{n}".format(n=n))
+        # Re-saving without changes does not write any links.
+        queries = self.saveAll()
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]["sql"].startswith("SELECT"))
+        self.assertEqual(HistoryLink.objects.count(), 10)
+        # Changing the slugs creates new links.
+        self.assertLessEqual(len(self.saveAll("new-")), max_queries)
+        self.assertEqual(HistoryLink.objects.count(), 20)
+        for obj in HistoryLinkTestModel.objects.all():
+            self.assertEqual(HistoryLink.objects.get(permalink=obj.get_absolute_url()).object, obj)
+            self.assertEqual(HistoryLink.objects.get(permalink="/" + obj.slug[4:] + "/").object, obj)
+
+    def testBulkSave(self):
+        self.assertBulkSave(2)
+
+    def testBulkSaveWithoutUpsert(self):
+        with mock.patch.object(connection.features, "supports_update_conflicts_with_target", False, create=True):
+            self.assertBulkSave(3)
+
+    def testUpdateFields(self):
+        historylinks.unregister(HistoryLinkTestModel)
+        historylinks.register(HistoryLinkTestModel, permalink_fields=("slug",))
+        obj = HistoryLinkTestModel.objects.create(slug="foo")
+        # Saves that do not update the permalink fields are ignored.
+        with self.assertNumQueries(1):
+            obj.save(update_fields=("modified",))
+        obj.slug = "bar"
+        obj.save(update_fields=("slug",))
+        self.assertEqual(HistoryLink.objects.get(permalink="/foo/").object, obj)
+        self.assertEqual(HistoryLink.objects.get(permalink="/bar/").object, obj)
+
+    def tearDown(self):
+        historylinks.unregister(HistoryLinkTestModel)
+
+
+class HistoryLinkContextTest(TestCase):
+
+    def setUp(self):
+        historylinks.register(HistoryLinkTestModel)
+
+    def testWrap(self):
+        obj = HistoryLinkTestModel.objects.create(slug="foo")
+        obj.slug = "bar"
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with historylinks.update_history_links():
+                # Unwrapped functions do not share the history link context.
+                self.assertFalse(executor.submit(history_link_context_manager.is_active).result())
+                # Wrapped functions add to the history link context.
+                executor.submit(historylinks.wrap(default_history_link_manager._objs_saved), [obj]).result()
+                self.assertTrue(history_link_context_manager.has_pending())
+                self.assertFalse(HistoryLink.objects.for_permalink("/bar/").exists())
+        self.assertEqual(HistoryLink.objects.for_permalink("/bar/").get().object, obj)
+
+    def testResolvesBackendLazily(self):
+        with mock.patch("historylinks.registration.get_backend", return_value=None) as get_backend:
+            with historylinks.update_history_links():
+                self.assertFalse(get_backend.called)
+            # A context that saves nothing never resolves the backend.
+            self.assertFalse(get_backend.called)
+            with historylinks.update_history_links():
+                HistoryLinkTestModel.objects.create(slug="foo")
+                HistoryLinkTestModel.objects.create(slug="bar")
+            get_backend.assert_called_once_with()
+        self.assertEqual(HistoryLink.objects.count(), 2)
+
+    def testCoalescesRepeatedSaves(self):
+        obj = HistoryLinkTestModel.objects.create(slug="foo")
+        with historylinks.update_history_links():
+            # Save separate instances of the same row.
+            for slug in ("bar", "baz"):
+                instance = HistoryLinkTestModel.objects.get(pk=obj.pk)
+                instance.slug = slug
+                instance.save()
+            # Only the latest permalinks are kept, without the instance.
+            tasks = history_link_context_manager._get_level().tasks
+            self.assertEqual(len(tasks), 1)
+            self.assertEqual(list(tasks.values()), [(HistoryLinkTestModel, None, (("get_absolute_url", "/baz/"),))])
+        self.assertEqual(set(HistoryLink.objects.values_list("permalink", flat=True)), {"/foo/", "/baz/"})
+
+    async def testContextIsolatedBetweenTasks(self):
+        content_type_id = (await sync_to_async(ContentType.objects.get_for_model)(HistoryLinkTestModel)).id
+        foo = HistoryLinkTestModel(pk=1, slug="foo")
+        bar = HistoryLinkTestModel(pk=2, slug="bar")
+
+        async def save(obj):
+            history_link_context_manager.start()
+            try:
+                history_link_context_manager.add_to_context(default_history_link_manager, obj)
+                await asyncio.sleep(0)
+                return list(history_link_context_manager._get_level().tasks)
+            finally:
+                history_link_context_manager.invalidate()
+                history_link_context_manager.end()
+
+        self.assertEqual(await asyncio.gather(save(foo), save(bar)), [
+            [(default_history_link_manager, content_type_id, 1)],
+            [(default_history_link_manager, content_type_id, 2)],
+        ])
+        self.assertFalse(history_link_context_manager.is_active())
+
+    def tearDown(self):
+        historylinks.unregister(HistoryLinkTestModel)
+
+
+class HistoryLinkBulkOperationsTest(TestCase):
+
+    def setUp(self):
+        historylinks.register(HistoryLinkBulkTestModel)
+        self.category = HistoryLinkTestCategory.objects.create(slug="category")
+
+    def assertLinksSaved(self, objs):
+        self.assertEqual(
+            {history_link.permalink: history_link.object for history_link in HistoryLink.objects.all()},
+            {permalink: obj for obj, permalink in objs},
+        )
+
+    def bulkCreate(self, **kwargs):
+        HistoryLinkBulkTestModel.objects.bulk_create([
+            HistoryLinkBulkTestModel(category=self.category, slug="foo-{n}".format(n=n))
+            for n in range(3)
+        ], **kwargs)
+        # Not all databases return the primary keys of the created objects.
+        return list(HistoryLinkBulkTestModel.objects.order_by("pk"))
+
+    def testBulkCreate(self):
+        objs = self.bulkCreate()
+        self.assertLinksSaved([(obj, obj.get_absolute_url()) for obj in objs])
+
+    def testBulkCreateIgnoreConflicts(self):
+        HistoryLinkBulkTestModel.objects.create(category=self.category, slug="foo-0")
+        HistoryLink.objects.all().delete()
+        objs = self.bulkCreate(ignore_conflicts=True)
+        self.assertLinksSaved([(obj, obj.get_absolute_url()) for obj in objs])
+
+    def testBulkCreateWithoutUniqueFields(self):
+        with mock.patch("historylinks.registration._get_unique_attnames", return_value=[]):
+            with self.assertLogs("historylinks", "WARNING"):
+                self.bulkCreate(ignore_conflicts=True)
+        self.assertEqual(HistoryLink.objects.count(), 0)
+
+    def testBulkUpdate(self):
+        objs = self.bulkCreate()
+        old_permalinks = [obj.get_absolute_url() for obj in objs]
+        for obj in objs:
+            obj.slug = "bar-" + obj.slug
+        HistoryLinkBulkTestModel.objects.bulk_update(objs, ["slug"])
+        self.assertLinksSaved(list(zip(objs, old_permalinks)) + [(obj, obj.get_absolute_url()) for obj in objs])
+
+    def testUpdate(self):
+        objs = self.bulkCreate()
+        old_permalink = objs[0].get_absolute_url()
+        HistoryLinkBulkTestModel.objects.filter(slug="foo-0").update(slug="bar")
+        objs[0].refresh_from_db()
+        self.assertLinksSaved([(obj, obj.get_absolute_url()) for obj in objs] + [(objs[0], old_permalink)])
+
+    def testUpdateWithUnlimitedBatchSize(self):
+        objs = self.bulkCreate()
+        # Databases without a parameter limit batch all objects at once.
+        with mock.patch.object(connection.ops, "bulk_batch_size", lambda fields, objs: len(objs)):
+            self.assertEqual(HistoryLinkBulkTestModel.objects.filter(slug="missing").update(slug="bar"), 0)
+            HistoryLinkBulkTestModel.objects.filter(slug="foo-0").update(slug="bar")
+        objs[0].refresh_from_db()
+        self.assertEqual(HistoryLink.objects.for_permalink("/category/bar/").get().object, objs[0])
+
+    def testUpdateInvalidatedContext(self):
+        objs = self.bulkCreate()
+        with historylinks.update_history_links():
+            HistoryLinkBulkTestModel.objects.filter(slug="foo-0").update(slug="bar")
+            self.assertTrue(history_link_context_manager.has_pending())
+            history_link_context_manager.invalidate()
+        self.assertLinksSaved([(obj, obj.get_absolute_url()) for obj in objs])
+
+    def testUpdateHistoryLinksForQuerySet(self):
+        historylinks.unregister(HistoryLinkBulkTestModel)
+        objs = self.bulkCreate()
+        historylinks.register(HistoryLinkBulkTestModel)
+        self.assertEqual(HistoryLink.objects.count(), 0)
+        self.assertEqual(historylinks.update_history_links_for_queryset(HistoryLinkBulkTestModel.objects.all()), 3)
+        self.assertLinksSaved([(obj, obj.get_absolute_url()) for obj in objs])
+
+    def testPrefetchRelated(self):
+        historylinks.unregister(HistoryLinkBulkTestModel)
+        for n in range(3):
+            category = HistoryLinkTestCategory.objects.create(slug="category-{n}".format(n=n))
+            HistoryLinkBulkTestModel.objects.create(category=category, slug="foo")
+        historylinks.register(HistoryLinkBulkTestModel, select_related=("category",))
+        # Warm the content type cache, so only the objects and history links are queried.
+        ContentType.objects.get_for_model(HistoryLinkBulkTestModel)
+        # The categories are loaded with the objects.
+        with self.assertNumQueries(3):
+            historylinks.update_history_links_for_queryset(HistoryLinkBulkTestModel.objects.all())
+        # The categories are prefetched at the end of the context.
+        with CaptureQueriesContext(connection) as queries:
+            with historylinks.update_history_links():
+                for obj in HistoryLinkBulkTestModel.objects.all():
+                    obj.slug = "bar"
+                    obj.save()
+        self.assertEqual(len([query for query in queries if "historylinktestcategory" in query["sql"]]), 1)
+        self.assertEqual(
+            set(HistoryLink.objects.values_list("permalink", flat=True)),
+            {"/category-{n}/{slug}/".format(n=n, slug=slug) for n in range(3) for slug in ("foo", "bar")},
+        )
+
+    def tearDown(self):
+        historylinks.unregister(HistoryLinkBulkTestModel)
+
+
+class HistoryLinkDeferredTest(TestCase):
+
+    def setUp(self):
+        historylinks.register(HistoryLinkTestModel)
+
+    def saveObjects(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with historylinks.update_history_links():
+                objs = [HistoryLinkTestModel.objects.create(slug="foo-{n}".format(n=n)) for n in range(3)]
+                for obj in objs:
+                    obj.slug = "bar-" + obj.slug
+                    obj.save()
+        return objs
+
+    def assertLinksSaved(self, objs):
+        self.assertEqual(
+            {history_link.permalink: history_link.object for history_link in HistoryLink.objects.all()},
+            {obj.get_absolute_url(): obj for obj in objs},
+        )
+
+    @override_settings(HISTORYLINKS_DEFERRED_BACKEND="historylinks.backends.ThreadPoolBackend")
+    def testThreadPoolBackend(self):
+        with mock.patch.object(ThreadPoolBackend, "_get_executor", return_value=InProcessExecutor()):
+            objs = self.saveObjects()
+        self.assertEqual(InProcessExecutor.task_count, 1)
+        self.assertLinksSaved(objs)
+
+    @override_settings(HISTORYLINKS_DEFERRED_BACKEND="historylinks.backends.DatabaseBackend")
+    def testDatabaseBackend(self):
+        objs = self.saveObjects()
+        # Repeated saves of the same object are coalesced.
+        self.assertEqual(HistoryLinkQueueItem.objects.count(), 3)
+        self.assertEqual(HistoryLink.objects.count(), 0)
+        stdout = StringIO()
+        call_command("processhistorylinks", stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "Processed 3 queued objects.\n")
+        self.assertEqual(HistoryLinkQueueItem.objects.count(), 0)
+        self.assertLinksSaved(objs)
+
+    def testProcessHistoryLinksRequiresDatabaseBackend(self):
+        with self.assertRaises(CommandError):
+            call_command("processhistorylinks", stdout=StringIO())
+
+    def tearDown(self):
+        historylinks.unregister(HistoryLinkTestModel)
+
+
+class HistoryLinkSignalsTest(TestCase):
+
+    def setUp(self):
+        historylinks.register(HistoryLinkTestModel)
+        self.obj = HistoryLinkTestModel.objects.create(slug="foo")
+        self.signals = []
+
+    def receiver(self, signal, sender, **kwargs):
+        self.signals.append((signal, kwargs))
+
+    @contextmanager
+    def receive(self, signal):
+        signal.connect(self.receiver)
+        try:
+            yield
+        finally:
+            signal.disconnect(self.receiver)
+
+    def testHistoryLinksSaved(self):
+        with self.receive(history_links_saved):
+            self.obj.slug = "bar"
+            self.obj.save()
+            with historylinks.update_history_links():
+                HistoryLinkTestModel.objects.create(slug="baz")
+                HistoryLinkTestModel.objects.create(slug="qux")
+        self.assertEqual(len(self.signals), 2)
+        self.assertEqual(self.signals[0][1]["object_count"], 1)
+        self.assertEqual(self.signals[0][1]["link_count"], 1)
+        self.assertEqual(self.signals[1][1]["object_count"], 2)
+        self.assertEqual(self.signals[1][1]["link_count"], 2)
+        for _, kwargs in self.signals:
+            self.assertGreater(kwargs["query_count"], 0)
+            self.assertGreaterEqual(kwargs["duration"], 0)
+
+    def testCurrentURLResolved(self):
+        self.obj.slug = "bar"
+        self.obj.save()
+        with self.receive(current_url_resolved):
+            historylinks.get_current_url("/foo/")
+        self.assertEqual(len(self.signals), 1)
+        self.assertEqual(self.signals[0][1]["path"], "/foo/")
+        self.assertEqual(self.signals[0][1]["current_url"], "/bar/")
+        self.assertEqual(self.signals[0][1]["query_count"], 2)
+
+    def testResponseRescued(self):
+        self.obj.slug = "bar"
+        self.obj.save()
+        with self.receive(response_rescued):
+            self.client.get("/foo/")
+            self.client.get("/baz/")
+        self.assertEqual(len(self.signals), 2)
+        self.assertEqual(self.signals[0][1]["path"], "/foo/")
+        self.assertEqual(self.signals[0][1]["redirect_url"], "/bar/")
+        self.assertEqual(self.signals[1][1]["path"], "/baz/")
+        self.assertEqual(self.signals[1][1]["redirect_url"], None)
+
     def tearDown(self):
         historylinks.unregister(HistoryLinkTestModel)
 
@@ -87,5 +811,212 @@ class HistoryLinkManagementTestCase(TestCase):
         assert_historylink_is_sane()
         self.assertEqual(stdout.getvalue(), f"Refreshed history link for HistoryLinkTestModel object ({obj.pk}).\n")
 
+    def test_buildhistorylinks_batch_size(self):
+        objs = [HistoryLinkTestModel.objects.create(slug="foo-{n}".format(n=n)) for n in range(5)]
+        historylinks.register(HistoryLinkTestModel)
+        stdout = StringIO()
+        call_command("buildhistorylinks", stdout=stdout, batch_size=2)
+        self.assertEqual(stdout.getvalue(), "Refreshed 5 history links.\n")
+        self.assertEqual(
+            {history_link.permalink: history_link.object for history_link in HistoryLink.objects.all()},
+            {obj.get_absolute_url(): obj for obj in objs},
+        )
+
+    def test_buildhistorylinks_workers(self):
+        objs = [HistoryLinkTestModel.objects.create(slug="foo-{n}".format(n=n)) for n in range(5)]
+        historylinks.register(HistoryLinkTestModel)
+        stdout = StringIO()
+        # Run the shards in-process, since worker processes cannot see the test database.
+        with mock.patch("historylinks.management.commands.buildhistorylinks.ProcessPoolExecutor", InProcessExecutor):
+            call_command("buildhistorylinks", stdout=stdout, workers=2, verbosity=2)
+        self.assertEqual(InProcessExecutor.task_count, 2)
+        self.assertEqual(stdout.getvalue(), "Refreshed 5 history link(s) for history link test model.\n")
+        self.assertEqual(
+            {history_link.permalink: history_link.object for history_link in HistoryLink.objects.all()},
+            {obj.get_absolute_url(): obj for obj in objs},
+        )
+
+    def test_buildhistorylinks_resume(self):
+        objs = [HistoryLinkTestModel.objects.create(slug="foo-{n}".format(n=n)) for n in range(5)]
+        historylinks.register(HistoryLinkTestModel)
+        # Interrupt the run after the first batch, which is not saved.
+        with mock.patch.object(buildhistorylinks, "_bulk_save_history_links", side_effect=[
+            None,
+            Exception("Interrupted"),
+        ]):
+            with self.assertRaises(Exception):
+                call_command("buildhistorylinks", stdout=StringIO(), batch_size=2)
+        checkpoint = HistoryLinkBuildCheckpoint.objects.get()
+        self.assertEqual(checkpoint.last_object_id, str(objs[1].pk))
+        self.assertFalse(checkpoint.is_complete)
+        # Resume the run.
+        stdout = StringIO()
+        call_command("buildhistorylinks", stdout=stdout, batch_size=2, resume=True)
+        self.assertEqual(stdout.getvalue(), "Refreshed 3 history links.\n")
+        self.assertEqual(
+            set(HistoryLink.objects.values_list("permalink", flat=True)),
+            {obj.get_absolute_url() for obj in objs[2:]},
+        )
+        self.assertTrue(HistoryLinkBuildCheckpoint.objects.get().is_complete)
+        # Resuming a complete run does nothing.
+        stdout = StringIO()
+        call_command("buildhistorylinks", stdout=stdout, resume=True)
+        self.assertEqual(stdout.getvalue(), "Refreshed 0 history links.\n")
+
+    def test_buildhistorylinks_resume_resets_all_models(self):
+        objs = [HistoryLinkTestModel.objects.create(slug="foo-{n}".format(n=n)) for n in range(3)]
+        category = HistoryLinkTestCategory.objects.create(slug="category")
+        bulk_objs = [
+            HistoryLinkBulkTestModel.objects.create(category=category, slug="foo-{n}".format(n=n))
+            for n in range(2)
+        ]
+        historylinks.register(HistoryLinkTestModel)
+        historylinks.register(HistoryLinkBulkTestModel)
+        try:
+            # Complete a run, then interrupt a new run in the first model.
+            call_command("buildhistorylinks", stdout=StringIO(), batch_size=2)
+            HistoryLink.objects.all().delete()
+            with mock.patch.object(buildhistorylinks, "_bulk_save_history_links", side_effect=Exception("Interrupted")):
+                with self.assertRaises(Exception):
+                    call_command("buildhistorylinks", stdout=StringIO(), batch_size=2)
+            self.assertFalse(HistoryLinkBuildCheckpoint.objects.filter(is_complete=True).exists())
+            # Resuming the run rebuilds every model.
+            stdout = StringIO()
+            call_command("buildhistorylinks", stdout=stdout, batch_size=2, resume=True)
+            self.assertEqual(stdout.getvalue(), "Refreshed 5 history links.\n")
+            self.assertEqual(
+                set(HistoryLink.objects.values_list("permalink", flat=True)),
+                {obj.get_absolute_url() for obj in objs + bulk_objs},
+            )
+        finally:
+            historylinks.unregister(HistoryLinkBulkTestModel)
+
+    def test_buildhistorylinks_since(self):
+        old_obj = HistoryLinkTestModel.objects.create(slug="foo")
+        HistoryLinkTestModel.objects.filter(pk=old_obj.pk).update(modified=timezone.now() - timedelta(days=2))
+        new_obj = HistoryLinkTestModel.objects.create(slug="bar")
+        historylinks.register(HistoryLinkTestModel)
+        stdout = StringIO()
+        call_command("buildhistorylinks", stdout=stdout, since=(timezone.now() - timedelta(days=1)).isoformat())
+        self.assertEqual(stdout.getvalue(), "Refreshed 1 history links.\n")
+        self.assertEqual(HistoryLink.objects.get().object, new_obj)
+
+    def test_prunehistorylinks(self):
+        historylinks.register(HistoryLinkTestModel)
+        objs = [HistoryLinkTestModel.objects.create(slug="foo-{n}".format(n=n)) for n in range(5)]
+        HistoryLinkTestModel.objects.filter(pk__in=[objs[1].pk, objs[3].pk, objs[4].pk]).delete()
+        self.assertEqual(HistoryLink.objects.count(), 5)
+        stdout = StringIO()
+        call_command("prunehistorylinks", stdout=stdout, batch_size=2)
+        self.assertEqual(stdout.getvalue(), "Pruned 3 history links.\n")
+        self.assertEqual(
+            set(HistoryLink.objects.values_list("permalink", flat=True)),
+            {objs[0].get_absolute_url(), objs[2].get_absolute_url()},
+        )
+        stdout = StringIO()
+        call_command("prunehistorylinks", stdout=stdout, verbosity=2)
+        self.assertEqual(stdout.getvalue(), "Pruned 0 history link(s) for history link test model.\n")
+
+    def test_prunehistorylinks_tombstone(self):
+        historylinks.register(HistoryLinkTestModel)
+        objs = [HistoryLinkTestModel.objects.create(slug="foo-{n}".format(n=n)) for n in range(3)]
+        HistoryLinkTestModel.objects.filter(pk=objs[1].pk).delete()
+        stdout = StringIO()
+        call_command("prunehistorylinks", stdout=stdout, tombstone=True)
+        self.assertEqual(stdout.getvalue(), "Pruned 1 history links.\n")
+        self.assertEqual(HistoryLink.objects.count(), 3)
+        self.assertEqual(HistoryLink.objects.filter(deleted__isnull=False).get().permalink, objs[1].get_absolute_url())
+        # Existing tombstones are not marked again.
+        stdout = StringIO()
+        call_command("prunehistorylinks", stdout=stdout, tombstone=True)
+        self.assertEqual(stdout.getvalue(), "Pruned 0 history links.\n")
+
+    def test_exporthistorylinks(self):
+        historylinks.register(HistoryLinkTestModel)
+        obj = HistoryLinkTestModel.objects.create(slug="foo")
+        obj.slug = "bar"
+        obj.save()
+        HistoryLinkTestModel.objects.create(slug="~baz")
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command("exporthistorylinks", stdout=stdout, stderr=stderr)
+        self.assertEqual(stdout.getvalue(), '"/foo/" "/bar/";\n')
+        self.assertTrue(stderr.getvalue().startswith("Exported 1 history links. Use --since="))
+        stdout = StringIO()
+        call_command("exporthistorylinks", stdout=stdout, stderr=StringIO(), format="rewritemap", batch_size=1)
+        self.assertEqual(stdout.getvalue(), "/foo/ /bar/\n")
+        # Tombstones and current URLs are included in JSON lines.
+        HistoryLink.objects.filter(permalink="/~baz/").update(deleted=timezone.now())
+        stdout = StringIO()
+        call_command("exporthistorylinks", stdout=stdout, stderr=StringIO(), format="jsonl")
+        entries = {entry["permalink"]: entry for entry in map(json.loads, stdout.getvalue().splitlines())}
+        self.assertEqual(
+            {permalink: (entry["current_url"], entry["gone"]) for permalink, entry in entries.items()},
+            {"/foo/": ("/bar/", False), "/bar/": ("/bar/", False), "/~baz/": (None, True)},
+        )
+
+    def test_exporthistorylinks_since(self):
+        historylinks.register(HistoryLinkTestModel)
+        obj = HistoryLinkTestModel.objects.create(slug="foo")
+        obj.slug = "bar"
+        obj.save()
+        HistoryLink.objects.update(updated=timezone.now() - timedelta(days=2))
+        obj.slug = "baz"
+        obj.save()
+        with tempfile.TemporaryDirectory() as output_dir:
+            output_path = os.path.join(output_dir, "redirects.map")
+            stdout = StringIO()
+            call_command(
+                "exporthistorylinks",
+                stdout=stdout,
+                output=output_path,
+                since=(timezone.now() - timedelta(days=1)).isoformat(),
+            )
+            self.assertTrue(stdout.getvalue().startswith("Exported 0 history links."))
+            with open(output_path) as output:
+                self.assertEqual(output.read(), "")
+            with self.settings(HISTORYLINKS_STORE_CURRENT_URL=True):
+                call_command("buildhistorylinks", stdout=StringIO())
+                call_command(
+                    "exporthistorylinks",
+                    stdout=StringIO(),
+                    output=output_path,
+                    since=(timezone.now() - timedelta(days=1)).isoformat(),
+                )
+            with open(output_path) as output:
+                self.assertEqual(output.read(), '"/foo/" "/baz/";\n"/bar/" "/baz/";\n')
+
+    @override_settings(HISTORYLINKS_ON_DELETE="delete")
+    def test_on_delete(self):
+        historylinks.register(HistoryLinkTestModel)
+        obj = HistoryLinkTestModel.objects.create(slug="foo")
+        obj.slug = "bar"
+        obj.save()
+        other_obj = HistoryLinkTestModel.objects.create(slug="baz")
+        obj.delete()
+        self.assertEqual(HistoryLink.objects.get().object, other_obj)
+
     def tearDown(self):
         historylinks.unregister(HistoryLinkTestModel)
+
+
+class InProcessExecutor(object):
+
+    """A stand-in for ProcessPoolExecutor that runs tasks in the current process."""
+
+    task_count = 0
+
+    def __init__(self, *args, **kwargs):
+        InProcessExecutor.task_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def submit(self, func, *args):
+        InProcessExecutor.task_count += 1
+        future = Future()
+        future.set_result(func(*args))
+        return future